@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Benchmarks training, loading, scoring and sampling for each smoother, on
+synthetic corpora with a Zipfian distribution of word types, so that the
+results can be compared across runs (and machines) of the same configuration.
+
+For each smoother (and for the n-gram smoothers, each of the --orders),
+reports
+  * training speed, in tokens per second, for `LanguageModel.train`
+  * the size of the saved model
+  * the time that `LanguageModel.load` takes in a fresh process, and how
+    much that adds to the process's resident set size (RSS)
+  * scoring speed, in n-grams per second and microseconds per n-gram, for
+    `scoring.file_log_prob`
+  * sampling speed, in sentences per second, for `sampler.Sampler` (which
+    needs a model of order 3 or less)
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+
+from benchmark_mmap import memory_usage
+from build_vocab import build_vocab, save_vocab
+from probs import LanguageModel, num_tokens, read_vocab
+from sampler import Sampler
+from scoring import file_log_prob
+from train_lm import CLASSES, NGRAM_SMOOTHERS, SMOOTHERS, ADDLAMBDA, BACKOFF, KNESERNEY, LOGLINEAR, IMPROVED
+
+log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--smoothers",
+        nargs="+",
+        choices=SMOOTHERS,
+        default=SMOOTHERS,
+        help="Smoothers to benchmark (default all)",
+    )
+    parser.add_argument(
+        "--orders",
+        type=int,
+        nargs="+",
+        default=[3],
+        help=f"N-gram orders to benchmark the {' and '.join(NGRAM_SMOOTHERS)} smoothers at "
+             "(default 3; the other smoothers are always trigram models)",
+    )
+    parser.add_argument(
+        "--min_count",
+        type=int,
+        default=1,
+        help=f"Prune n-grams of order 3 and up seen fewer times than this, for the {' and '.join(NGRAM_SMOOTHERS)} "
+             "smoothers (default 1, no pruning)",
+    )
+    parser.add_argument(
+        "--tokens",
+        type=int,
+        default=10 ** 6,
+        help="Number of tokens in the synthetic training corpus (default 1000000)",
+    )
+    parser.add_argument(
+        "--test_tokens",
+        type=int,
+        default=10 ** 5,
+        help="Number of tokens in the synthetic test corpus (default 100000)",
+    )
+    parser.add_argument(
+        "--vocab_size",
+        type=int,
+        default=10000,
+        help="Number of word types that the corpora are drawn from (default 10000)",
+    )
+    parser.add_argument(
+        "--zipf",
+        type=float,
+        default=1.0,
+        help="Exponent s of the Zipfian distribution p(r) ∝ 1/r^s of the word type of rank r (default 1.0)",
+    )
+    parser.add_argument(
+        "--sentence_length",
+        type=float,
+        default=20,
+        help="Mean sentence length, in words (default 20)",
+    )
+    parser.add_argument(
+        "--sentences",
+        type=int,
+        default=10000,
+        help="Number of sentences to sample (default 10000)",
+    )
+    parser.add_argument(
+        "--lambda",
+        dest="lambda_",
+        type=float,
+        default=0.1,
+        help="Smoothing strength for the add-lambda smoothers (default 0.1)",
+    )
+    parser.add_argument(
+        "--dim",
+        type=int,
+        default=10,
+        help="Dimension of the random word embeddings for the log-linear smoothers (default 10)",
+    )
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        default=1,
+        help="Number of epochs of SGD for the log-linear smoothers (default 1)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=256,
+        help="Number of trigrams per SGD step for the log-linear smoothers (default 256)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to train with (default 1)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed for the corpora, the embeddings and sampling (default 0)",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        default=None,
+        help="Where to keep the corpora and models (default: a temporary directory that is then deleted)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Also save the configuration and results to this JSON file",
+    )
+
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        const=logging.DEBUG,
+        default=logging.WARNING,
+    )
+    verbosity.add_argument(
+        "-q", "--quiet", dest="verbose", action="store_const", const=logging.ERROR
+    )
+
+    return parser.parse_args()
+
+
+def write_zipfian_corpus(file: Path, tokens: int, vocab_size: int, s: float, sentence_length: float,
+                         rng: np.random.Generator) -> None:
+    """Write about `tokens` words (not counting EOS), drawn independently from
+    a Zipfian distribution over the types w0, w1, ..., one sentence per line."""
+    p = 1 / np.arange(1, vocab_size + 1) ** s
+    words = rng.choice(vocab_size, size=tokens, p=p / p.sum())
+    lengths = rng.geometric(1 / sentence_length, size=tokens // max(1, int(sentence_length)) * 2 + 1)
+    ends = np.cumsum(lengths)
+    ends = ends[ends < tokens]
+    with open(file, "w") as f:
+        for sentence in np.split(words, ends):
+            print(" ".join(f"w{w}" for w in sentence.tolist()), file=f)
+
+
+def write_random_lexicon(file: Path, vocab_file: Path, dim: int, rng: np.random.Generator) -> None:
+    """Write a lexicon of random embeddings for the words of a vocab (and OOL),
+    in the text format of `Lexicon.from_text_file`."""
+    words = list(read_vocab(vocab_file)) + ["OOL"]
+    embeddings = rng.normal(size=(len(words), dim))
+    with open(file, "w") as f:
+        print(f"{len(words)} {dim}", file=f)
+        for word, embedding in zip(words, embeddings):
+            print(word + "\t" + "\t".join(f"{x:.4f}" for x in embedding), file=f)
+
+
+def measure_load(model: Path, results) -> None:
+    """Load a model in this (fresh) process, and report how long that took and how much RSS it added."""
+    before = memory_usage()
+    start = time.perf_counter()
+    LanguageModel.load(model, mmap=True)
+    seconds = time.perf_counter() - start
+    after = memory_usage()
+    results.put({"load_seconds": seconds,
+                 "load_rss_mb": (after["rss_kb"] - before["rss_kb"]) / 1024 if after["rss_kb"] is not None else None})
+
+
+def benchmark(smoother: str, order: int, args: argparse.Namespace, directory: Path) -> Dict[str, Any]:
+    vocab = read_vocab(directory / "vocab.txt")
+    if smoother in [LOGLINEAR, IMPROVED]:
+        lm = CLASSES[smoother](vocab, directory / "lexicon.txt", 0.01, epochs=args.epochs, batch_size=args.batch_size)
+    elif smoother == BACKOFF:
+        lm = CLASSES[smoother](vocab, args.lambda_, order=order, min_count=args.min_count)
+    elif smoother == KNESERNEY:
+        lm = CLASSES[smoother](vocab, order=order, min_count=args.min_count)
+    elif smoother == ADDLAMBDA:
+        lm = CLASSES[smoother](vocab, args.lambda_)
+    else:
+        lm = CLASSES[smoother](vocab)
+    result: Dict[str, Any] = {"smoother": smoother, "order": order}
+
+    train_tokens = num_tokens(directory / "train.txt")
+    start = time.perf_counter()
+    lm.train(directory / "train.txt", jobs=args.jobs)
+    result["train_seconds"] = time.perf_counter() - start
+    result["train_tokens_per_sec"] = train_tokens / result["train_seconds"]
+
+    model = directory / f"{smoother}~order={order}.model"
+    lm.save(model)
+    result["model_mb"] = sum(f.stat().st_size for f in model.iterdir()) / 2 ** 20
+
+    # Load in a fresh process, so that the RSS it adds isn't muddled by ours.
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure_load, args=(model, results))
+    process.start()
+    result.update(results.get())
+    process.join()
+
+    lm = LanguageModel.load(model, mmap=True)
+    test_tokens = num_tokens(directory / "test.txt")   # the number of n-grams
+    start = time.perf_counter()
+    file_log_prob(directory / "test.txt", lm)
+    result["score_seconds"] = time.perf_counter() - start
+    result["score_ngrams_per_sec"] = test_tokens / result["score_seconds"]
+    result["score_us_per_ngram"] = 10 ** 6 * result["score_seconds"] / test_tokens
+
+    if order > 3:   # the sampler conditions on two words of context
+        return result
+    sampler = Sampler(lm, seed=args.seed)
+    start = time.perf_counter()
+    sampler.sample(args.sentences, max_length=20)
+    result["sample_seconds"] = time.perf_counter() - start
+    result["sample_sentences_per_sec"] = args.sentences / result["sample_seconds"]
+    return result
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=args.verbose)
+
+    config = {name: value for name, value in vars(args).items() if name not in ["workdir", "output", "verbose"]}
+    environment = {"python": platform.python_version(), "numpy": np.__version__, "torch": torch.__version__,
+                   "machine": platform.machine(), "cpus": multiprocessing.cpu_count()}
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.workdir if args.workdir is not None else Path(tmp)
+        directory.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(args.seed)
+        for name, tokens in [("train.txt", args.tokens), ("test.txt", args.test_tokens)]:
+            write_zipfian_corpus(directory / name, tokens, args.vocab_size, args.zipf, args.sentence_length, rng)
+        save_vocab(build_vocab(directory / "train.txt", threshold=1), directory / "vocab.txt")
+        write_random_lexicon(directory / "lexicon.txt", directory / "vocab.txt", args.dim, rng)
+
+        print("smoother\torder\ttrain tok/s\tmodel MB\tload s\tload RSS MB\tscore n-grams/s\tscore µs/n-gram\t"
+              "sample sent/s")
+        for smoother in args.smoothers:
+            for order in args.orders if smoother in NGRAM_SMOOTHERS else [3]:
+                try:
+                    result = benchmark(smoother, order, args, directory)
+                except ValueError as e:   # e.g., the n-grams are too long to pack into 64-bit keys
+                    log.warning(f"Skipping {smoother} of order {order}: {e}")
+                    continue
+                results.append(result)
+                rss, sample = result["load_rss_mb"], result.get("sample_sentences_per_sec")
+                print(f"{smoother}\t{order}\t{result['train_tokens_per_sec']:.0f}\t{result['model_mb']:.1f}\t"
+                      f"{result['load_seconds']:.3f}\t{'n/a' if rss is None else f'{rss:.1f}'}\t"
+                      f"{result['score_ngrams_per_sec']:.0f}\t{result['score_us_per_ngram']:.2f}\t"
+                      f"{'n/a' if sample is None else f'{sample:.0f}'}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "environment": environment, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Measures the memory used per process when several processes score files
+with the same model at once, with and without memory-mapped loading
+(see `LanguageModel.load`).
+
+Each worker loads the model, scores the test files, and then reports
+its resident set size (RSS) and its proportional set size (PSS), which
+divides each shared page among the processes that share it.  With
+memory mapping, the model's pages are shared, so PSS per worker should
+shrink as the number of workers grows.  (PSS is only available on Linux.)
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from probs import LanguageModel
+from scoring import Scorer
+
+log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "model",
+        type=Path,
+        help="path to the trained model (saved as a directory, so that it can be memory-mapped)",
+    )
+    parser.add_argument(
+        "test_files",
+        type=Path,
+        nargs="*",
+        help="files for each worker to score after loading the model",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32],
+        help="numbers of concurrent workers to try (default 1 8 32)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="also save the results to this JSON file",
+    )
+    return parser.parse_args()
+
+
+def memory_usage() -> Dict[str, Optional[int]]:
+    """This process's RSS and PSS in kB, from /proc."""
+    usage: Dict[str, Optional[int]] = {"rss_kb": None, "pss_kb": None}
+    for file, field, key in [("/proc/self/status", "VmRSS:", "rss_kb"),
+                             ("/proc/self/smaps_rollup", "Pss:", "pss_kb")]:
+        try:
+            with open(file) as f:
+                for line in f:
+                    if line.startswith(field):
+                        usage[key] = int(line.split()[1])
+                        break
+        except OSError:
+            pass
+    return usage
+
+
+def worker(model: Path, test_files: List[Path], mmap: bool, barrier, results) -> None:
+    lm = LanguageModel.load(model, mmap=mmap)
+    scorer = Scorer([lm])
+    for file in test_files:
+        scorer(file)
+    barrier.wait()   # measure only once all the workers have loaded the model
+    results.put(memory_usage())
+    barrier.wait()   # and don't exit until all of them have measured
+
+
+def measure(model: Path, test_files: List[Path], mmap: bool, workers: int) -> Dict[str, float]:
+    # Start fresh processes, which don't share anything with this one.
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(model, test_files, mmap, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    usages = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary: Dict[str, float] = {"mmap": mmap, "workers": workers}
+    for key in ["rss_kb", "pss_kb"]:
+        values = [usage[key] for usage in usages if usage[key] is not None]
+        if values:
+            summary[f"mean_{key}"] = sum(values) / len(values)
+    return summary
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    summaries = []
+    print("mmap\tworkers\tRSS/worker (MB)\tPSS/worker (MB)")
+    for mmap in [False, True]:
+        for workers in args.workers:
+            summary = measure(args.model, args.test_files, mmap, workers)
+            summaries.append(summary)
+            rss, pss = (summary.get(key) for key in ["mean_rss_kb", "mean_pss_kb"])
+            print(f"{mmap}\t{workers}\t" + "\t".join("n/a" if kb is None else f"{kb / 1024:.1f}" for kb in [rss, pss]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 """
 Builds a vocabulary of all types that appear "often enough" in a training
-corpus.  The vocabulary is saved as a text file where each line is a word.  
+corpus.  The vocabulary is saved as a text file where each line is a word
+and its count, separated by a tab, from the most to the least frequent.
 Tokenization is handled by probs.py (currently tokenization at whitespace).
 """
 import argparse
+import heapq
 import sys
-from typing import Set, Counter
+from typing import Counter, List, Optional, Tuple
 from collections import Counter
+from operator import itemgetter
 from pathlib import Path
 
-from probs import EOS, OOV, Wordtype, read_tokens
+from probs import EOS, OOV, Chunk, Word, chunk_lines, corpus_chunks, map_chunks
 
 
 def parse_args():
@@ -19,7 +22,7 @@ def parse_args():
         "documents",
         nargs="+",
         type=Path,
-        help="A list of text documents from which to extract the vocabulary")
+        help="A list of text documents (or directories of them, or glob patterns) from which to extract the vocabulary")
     parser.add_argument(
         "--output",
         type=Path,
@@ -31,31 +34,81 @@ def parse_args():
         default=1,
         type=int,
         help="The minimum number of times a word has to appear for it to be included in the vocabulary (default 1)")
+    parser.add_argument(
+        "--max-size",
+        "--max_size",
+        dest="max_size",
+        default=None,
+        type=int,
+        help="Keep at most this many types (including OOV and EOS), the most frequent ones.  "
+             "This also bounds the memory used for counting, at the cost of approximate counts.")
+    parser.add_argument(
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of processes to count the words with (default 1)")
 
     return parser.parse_args()
 
-def build_vocab(*files: Path, threshold: int) -> Set[str]:
-    progress = 0
-    word_counts: Counter[Wordtype] = Counter()  # count of each word
-    for file in files:
-        for token in read_tokens(file):
-            word_counts[token] += 1
 
-    vocab = set(w for w in word_counts if word_counts[w] >= threshold)
-    vocab |= {  # the |= operator modifies vocab by taking its union with this set of size 2
-        OOV,
-        EOS,
-    }  # We make sure that EOS is in the vocab, even if read_tokens returns it too few times.
-       # But BOS is not in the vocab: it is never a possible outcome, only a context.
+def count_chunk_words(chunk: Chunk, vocab: None = None) -> Counter[Word]:
+    """How many times each word type occurs in a chunk of the documents,
+    reading them the same way as `read_tokens` (so every line ends in EOS)."""
+    text = chunk_lines(chunk).read()
+    word_counts = Counter(text.split())
+    word_counts[EOS] += text.count("\n") + (not text.endswith("\n") and text != "")
+    return word_counts
+
+
+def build_vocab(*documents: Path, threshold: int, max_size: Optional[int] = None,
+                jobs: int = 1) -> List[Tuple[Word, int]]:
+    """The vocab, as a list of word types with their counts, from the most
+    to the least frequent (ties in alphabetical order).  The documents are
+    counted in chunks, by `jobs` processes at once."""
+    if max_size is not None and max_size < 2:
+        raise ValueError(f"The vocab must have room for at least OOV and EOS, but max_size is {max_size}")
+
+    # With max_size, we only need the counts of the most frequent types.
+    # So whenever we're counting more than twice `capacity` types, we keep
+    # just the top `capacity` of them (much like a space-saving sketch).  A
+    # type that we drop may come back later, with its count starting over
+    # from 0, so its final count may be too low, but by at most the total
+    # of the largest counts dropped.
+    capacity = None if max_size is None else 4 * max_size
+    word_counts: Counter[Word] = Counter()  # count of each word
+    tokens = 0
+    eos = 0   # counted separately, so that it's never dropped
+    error = 0
+    for chunk_counts in map_chunks(count_chunk_words, corpus_chunks(documents), None, jobs):
+        tokens += sum(chunk_counts.values())
+        eos += chunk_counts.pop(EOS)
+        word_counts.update(chunk_counts)
+        if capacity is not None and len(word_counts) > 2 * capacity:
+            top = heapq.nlargest(capacity + 1, word_counts.items(), key=itemgetter(1))
+            error += top[-1][1]
+            word_counts = Counter(dict(top[:capacity]))
+    if error > 0:
+        sys.stderr.write(f"Counted only the {capacity} most frequent types at a time, "
+                         f"so counts may be up to {error} too low\n")
+
+    # We make sure that EOS and OOV are in the vocab, even if they occur too few times.
+    # (But BOS is not in the vocab: it is never a possible outcome, only a context.)
+    # OOV stands for all the tokens of the other types.
+    special = {EOS: eos, OOV: word_counts.pop(OOV, 0)}
+    words = sorted(((w, c) for w, c in word_counts.items() if c >= threshold), key=lambda wc: (-wc[1], wc[0]))
+    if max_size is not None:
+        words = words[:max_size - len(special)]
+    special[OOV] = tokens - special[EOS] - sum(c for _, c in words)
+    vocab = sorted(words + list(special.items()), key=lambda wc: (-wc[1], wc[0]))
 
     sys.stderr.write(f"Vocabulary size is {len(vocab)} types including OOV and EOS\n")
     return vocab
 
 
-def save_vocab(vocab: Set[str], output: Path):
+def save_vocab(vocab: List[Tuple[Word, int]], output: Path):
     with open(output, "wt") as f:
-        for word in vocab:
-            print(word, file=f)
+        for word, count in vocab:
+            print(f"{word}\t{count}", file=f)
 
 
 def main():
@@ -76,7 +129,7 @@ def main():
         vocab-genspam.txt
     """
     args = parse_args()
-    vocab = build_vocab(*args.documents, threshold=args.threshold)
+    vocab = build_vocab(*args.documents, threshold=args.threshold, max_size=args.max_size, jobs=args.jobs)
     save_vocab(vocab, args.output)
 
 if __name__ == '__main__':
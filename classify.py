@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Classifies each test file into one of K categories, each with its own
+smoothed trigram model, by choosing the category with the highest
+posterior probability.  Generalizes textcat.py and langid.py, which only
+handle two categories.  As there, the models must all have the same
+vocabulary.
+"""
+import argparse
+import logging
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+from probs import LanguageModel
+from scoring import score_files
+
+log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--model",
+        dest="models",
+        type=Path,
+        action="append",
+        required=True,
+        help="path to the trained model of a category (repeat once per category; all must share one vocabulary)"
+    )
+    parser.add_argument(
+        "--prior",
+        dest="priors",
+        type=float,
+        action="append",
+        default=None,
+        help="Prior probability of a category, in the same order as the models (default uniform)"
+    )
+    parser.add_argument(
+        "--label",
+        dest="labels",
+        type=str,
+        action="append",
+        default=None,
+        help="Name of a category, in the same order as the models (default: the model's filename)"
+    )
+    parser.add_argument(
+        "test_files",
+        type=Path,
+        nargs="*"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to score the test files with (default 1)",
+    )
+
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        const=logging.DEBUG,
+        default=logging.INFO
+    )
+    verbosity.add_argument(
+        "-q", "--quiet", dest="verbose", action="store_const", const=logging.WARNING
+    )
+
+    return parser.parse_args()
+
+
+def log_priors(priors: List[float]) -> np.ndarray:
+    """Log of the prior probabilities, which are renormalized if necessary."""
+    p = np.array(priors, dtype=np.float64)
+    if np.any(p <= 0):
+        raise ValueError(f"Prior probabilities must be positive: {priors}")
+    if not np.isclose(p.sum(), 1):
+        log.warning(f"Renormalizing prior probabilities that sum to {p.sum()}")
+    return np.log(p / p.sum())
+
+
+def check_vocabs(lms: Sequence[LanguageModel], names: Sequence[object]) -> None:
+    """Require all the models to have the same vocabulary, so that each test
+    file is integerized just once, however many models there are.
+
+    >>> from integerize import Integerizer
+    >>> from probs import UniformLanguageModel
+    >>> def uniform(*words): return UniformLanguageModel(Integerizer(["BOS", "EOS", "OOV", *words]))
+    >>> check_vocabs([uniform("the", "a"), uniform("the", "a")], ["en1", "en2"])
+    >>> check_vocabs([uniform("the", "a"), uniform("the", "a"), uniform("el", "la")], ["en1", "en2", "es"])
+    Traceback (most recent call last):
+    ...
+    ValueError: Model es doesn't have the same vocabulary as model en1
+    """
+    for lm, name in zip(lms[1:], names[1:]):
+        if lm.vocab != lms[0].vocab:
+            raise ValueError(f"Model {name} doesn't have the same vocabulary as model {names[0]}")
+
+
+def posteriors(log_probs: np.ndarray, log_priors: np.ndarray) -> np.ndarray:
+    """Posterior probabilities of the categories, given the log-probability
+    of the file under each category's model.  (This works in log space, since
+    the probability of a whole file underflows.)
+
+    >>> posteriors(np.array([-1000., -1000., -1001.]), np.log([0.25, 0.25, 0.5])).round(3)
+    array([0.366, 0.366, 0.269])
+    """
+    log_joint = log_probs + log_priors
+    log_joint -= log_joint.max()
+    joint = np.exp(log_joint)
+    return joint / joint.sum()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=args.verbose)
+
+    K = len(args.models)
+    labels = args.labels if args.labels is not None else [str(model) for model in args.models]
+    if len(labels) != K:
+        raise ValueError(f"Got {len(labels)} labels for {K} models")
+    if args.priors is not None and len(args.priors) != K:   # (before log_priors renormalizes them)
+        raise ValueError(f"Got {len(args.priors)} priors for {K} models")
+    priors = log_priors(args.priors if args.priors is not None else [1 / K] * K)
+
+    log.info("Testing...")
+    lms = [LanguageModel.load(model, mmap=True) for model in args.models]
+    check_vocabs(lms, args.models)
+
+    log.info("Per-file categories and posterior probabilities:")
+    counts = np.zeros(K, dtype=int)
+    # Score each file under all the models at once.
+    for file, log_probs in score_files(args.test_files, lms, args.jobs):
+        posterior = posteriors(np.array(log_probs), priors)
+        best = int(np.argmax(posterior))
+        counts[best] += 1
+        print(f"{labels[best]}\t{file}\t" + "\t".join(f"{p:.4g}" for p in posterior))
+
+    total = max(counts.sum(), 1)
+    for label, count in zip(labels, counts):
+        print(f"{count} files were more probably {label} ({round(count / total, 2) * 100}%)")
+
+
+if __name__ == "__main__":
+    main()
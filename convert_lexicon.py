@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Converts a lexicon of word embeddings from the text format (a header line,
+then one word per line followed by its tab-separated coordinates) to the
+binary format of `Lexicon.save_binary`.  The log-linear models can then
+open the binary file instantly, by memory-mapping it, instead of parsing
+the text file on every run.  Just pass the binary file as --lexicon.
+"""
+import argparse
+import logging
+from pathlib import Path
+
+from probs import Lexicon
+
+log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "lexicon",
+        type=Path,
+        help="Lexicon file in text format",
+    )
+    parser.add_argument(
+        "output",
+        type=Path,
+        help="Where to save the lexicon in binary format",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    lexicon = Lexicon.from_text_file(args.lexicon)
+    lexicon.save_binary(args.output)
+    log.info(f"Saved {len(lexicon.int_to_word)} embeddings of dimension {lexicon.embeddings.shape[1]} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,10 @@ import argparse
 import logging
 import math
 from pathlib import Path
-import torch
 
-from probs import LanguageModel, num_tokens, read_trigrams
+import profiling
+from probs import LanguageModel, num_tokens
+from scoring import file_log_prob, score_files   # (file_log_prob lives in scoring now, but is still importable from here)
 
 log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
 
@@ -27,6 +28,24 @@ def parse_args() -> argparse.Namespace:
         nargs="*"
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to score the test files with (default 1)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="At the end, print where the time went and how often the model's hot paths ran",
+    )
+    parser.add_argument(
+        "--profile_stats",
+        type=Path,
+        default=None,
+        help="With --profile, also save cProfile statistics to this file (for python -m pstats)",
+    )
+
     verbosity = parser.add_mutually_exclusive_group()
     verbosity.add_argument(
         "-v",
@@ -42,29 +61,16 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def file_log_prob(file: Path, lm: LanguageModel) -> float:
-    """The file contains one sentence per line. Return the total
-    log-probability of all these sentences, under the given language model.
-    (This is a natural log, as for all our internal computations.)
-    """
-    log_prob = 0
-    for (x, y, z) in read_trigrams(file, lm.vocab):
-        prob = lm.prob(x, y, z)  # p(z | xy)
-        #pdb.set_trace()
-        if torch.is_tensor(prob):
-            prob = prob.item()
-            log_prob += prob
-        else:
-            log_prob += math.log(prob)
-    return log_prob
-
-
 def main():
     args = parse_args()
     logging.basicConfig(level=args.verbose)
+    if args.profile:
+        profiling.enable(args.profile_stats)
+        if args.jobs > 1:
+            log.warning("--profile only records the main process, not the --jobs workers")
 
     log.info("Testing...")
-    lm = LanguageModel.load(args.model)
+    lm = LanguageModel.load(args.model, mmap=True)
     # We use natural log for our internal computations and that's
     # the kind of log-probability that file_log_prob returns.
     # But we'd like to print a value in bits: so we convert
@@ -72,8 +78,7 @@ def main():
 
     log.info("Per-file log-probabilities:")
     total_log_prob = 0.0
-    for file in args.test_files:
-        log_prob: float = file_log_prob(file, lm)
+    for file, (log_prob,) in score_files(args.test_files, [lm], args.jobs):
         print(f"{log_prob:g}\t{file}")
         total_log_prob += log_prob
 
@@ -83,6 +88,7 @@ def main():
     tokens = sum(num_tokens(test_file) for test_file in args.test_files)
     #print(tokens)
     print(f"Overall cross-entropy:\t{bits / tokens:.5f} bits per token")
+    profiling.report()
 
 
 if __name__ == "__main__":
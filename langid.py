@@ -9,7 +9,8 @@ import math
 from pathlib import Path
 import pdb
 
-from probs import LanguageModel, num_tokens, read_trigrams
+from probs import LanguageModel, num_tokens
+from scoring import score_files
 
 log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
 
@@ -33,6 +34,13 @@ def parse_args() -> argparse.Namespace:
         nargs="*"
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to score the test files with (default 1)",
+    )
+
     verbosity = parser.add_mutually_exclusive_group()
     verbosity.add_argument(
         "-v",
@@ -48,25 +56,13 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def file_log_prob(file: Path, lm: LanguageModel) -> float:
-    """The file contains one sentence per line. Return the total
-    log-probability of all these sentences, under the given language model.
-    (This is a natural log, as for all our internal computations.)
-    """
-    log_prob = 0.0
-    for (x, y, z) in read_trigrams(file, lm.vocab):
-        prob = lm.prob(x, y, z)  # p(z | xy)
-        log_prob += math.log(prob)
-    return log_prob
-
-
 def main():
     args = parse_args()
     logging.basicConfig(level=args.verbose)
 
     log.info("Testing...")
-    lm1 = LanguageModel.load(args.model[0])
-    lm2 = LanguageModel.load(args.model[1])
+    lm1 = LanguageModel.load(args.model[0], mmap=True)
+    lm2 = LanguageModel.load(args.model[1], mmap=True)
     #assert lm1.vocab == lm2.vocab, "Make sure both models have the same vocabulary"
     prior1 = args.prior
     prior2 = 1 - prior1
@@ -80,9 +76,8 @@ def main():
     class2 = 'SP'
     count_sp = 0
     count_en = 0
-    for file in args.test_files:
-        log_prob1: float = file_log_prob(file, lm1)
-        log_prob2: float = file_log_prob(file, lm2)
+    # Score each file under both models at once.
+    for file, (log_prob1, log_prob2) in score_files(args.test_files, [lm1, lm2], args.jobs):
         if log_prob1+math.log(prior1) > log_prob2+math.log(prior2):
             print(f"EN\t{file}")
             count_en+=1
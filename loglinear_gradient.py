@@ -0,0 +1,141 @@
+"""
+loglinear_gradient.py
+
+Computes the gradient of the log-linear language model's training
+objective in closed form, instead of building an autograd graph.
+
+For the model p(z | xy) ∝ exp(x'Xz + y'Yz), the gradient of log p(z | xy)
+with respect to X is the outer product x z' of the observed trigram minus
+its expectation x E[z]' under the model's distribution over z, and
+similarly for Y.  Summed over a minibatch of trigrams, this is just two
+matrix products.  We compute them into buffers that are allocated once
+and reused on every step, and store the results in the parameters'
+`.grad` fields, so that any torch optimizer (such as `torch.optim.SGD`
+or `SGD_convergent.ConvergentSGD`) can take the step.
+"""
+import torch as th
+from torch import nn
+
+
+class LogLinearGradient:
+    """Gradient engine for a log-linear model with parameters X and Y.
+
+    `emb` is the matrix whose row i is the embedding of word type i.  The
+    outcomes z range over rows 1 and up, since row 0 is BOS.  The objective is
+    the one of `EmbeddingLogLinearLanguageModel.objective`:
+        F = (sum_i log p(z_i | x_i y_i) - B * l2 * (||X|| + ||Y||)) / N
+    for a minibatch of B trigrams i out of a corpus of N.
+    """
+
+    def __init__(self, emb: th.Tensor, X: nn.Parameter, Y: nn.Parameter, l2: float, batch_size: int):
+        self.X = X
+        self.Y = Y
+        self.l2 = l2
+        self.batch_size = batch_size
+        # Work in double precision, like the autograd path.
+        self.emb = emb.double()
+        self.outcomes = self.emb[1:]
+        V, d = self.outcomes.shape
+
+        # Preallocated buffers.  For a final batch with fewer than batch_size
+        # trigrams, we use the first rows of each buffer.
+        self._X = th.empty(d, d, dtype=th.float64)
+        self._Y = th.empty(d, d, dtype=th.float64)
+        self._ex = th.empty(batch_size, d, dtype=th.float64)
+        self._ey = th.empty(batch_size, d, dtype=th.float64)
+        self._ez = th.empty(batch_size, d, dtype=th.float64)
+        self._xy = th.empty(batch_size, d, dtype=th.float64)     # x'X + y'Y for each trigram
+        self._scores = th.empty(batch_size, V, dtype=th.float64)  # then the probabilities of the outcomes
+        self._residual = th.empty(batch_size, d, dtype=th.float64)  # z - E[z]
+        self._dX = th.empty(d, d, dtype=th.float64)
+        self._dY = th.empty(d, d, dtype=th.float64)
+
+    @th.no_grad()
+    def step(self, xs: th.Tensor, ys: th.Tensor, zs: th.Tensor, N: int) -> float:
+        """Compute the objective F on a minibatch of trigrams, and set X.grad
+        and Y.grad to the gradient of -F (the function to minimize), just as
+        (-F).backward() would.  Returns F."""
+        B = len(zs)
+        if B > self.batch_size:
+            raise ValueError(f"Batch of {B} trigrams is larger than the buffers ({self.batch_size})")
+        X, Y = self._X.copy_(self.X), self._Y.copy_(self.Y)
+        ex = th.index_select(self.emb, 0, xs, out=self._ex[:B])
+        ey = th.index_select(self.emb, 0, ys, out=self._ey[:B])
+        ez = th.index_select(self.emb, 0, zs, out=self._ez[:B])
+
+        # Scores of all the outcomes, and the log-likelihood of the observed ones.
+        xy = th.matmul(ex, X, out=self._xy[:B]).addmm_(ey, Y)
+        scores = th.matmul(xy, self.outcomes.T, out=self._scores[:B])
+        log_Z = th.logsumexp(scores, 1)
+        log_likelihood = (scores.gather(1, (zs - 1).unsqueeze(1)).squeeze(1) - log_Z).sum().item()
+
+        # Turn the scores into probabilities in place, and get the residuals z - E[z].
+        probs = scores.sub_(log_Z.unsqueeze(1)).exp_()
+        residual = th.matmul(probs, self.outcomes, out=self._residual[:B]).neg_().add_(ez)
+
+        # The gradient of the log-likelihood is sum_i x_i (z_i - E[z_i])', and similarly for Y.
+        dX = th.matmul(ex.T, residual, out=self._dX)
+        dY = th.matmul(ey.T, residual, out=self._dY)
+
+        # The gradient of ||X|| is X / ||X||.  (Like autograd, we use 0 at X = 0.)
+        norm_X, norm_Y = th.linalg.norm(X).item(), th.linalg.norm(Y).item()
+        if norm_X > 0:
+            dX.sub_(X, alpha=B * self.l2 / norm_X)
+        if norm_Y > 0:
+            dY.sub_(Y, alpha=B * self.l2 / norm_Y)
+
+        # We want the gradient of -F, so flip the sign as we scale by 1/N.
+        _set_grad(self.X, dX.mul_(-1 / N))
+        _set_grad(self.Y, dY.mul_(-1 / N))
+        return (log_likelihood - B * self.l2 * (norm_X + norm_Y)) / N
+
+
+def _set_grad(param: nn.Parameter, grad: th.Tensor) -> None:
+    if param.grad is None:
+        param.grad = th.empty_like(param)
+    param.grad.copy_(grad)
+
+
+def test_me():
+    th.manual_seed(0)
+    V, d, B, N, l2 = 20, 5, 8, 100, 0.5
+    emb = th.randn(V, d)
+    X = nn.Parameter(th.randn(d, d))
+    Y = nn.Parameter(th.randn(d, d))
+    xs, ys, zs = th.randint(0, V, (B,)), th.randint(0, V, (B,)), th.randint(1, V, (B,))
+
+    def objective(X: th.Tensor, Y: th.Tensor) -> th.Tensor:
+        E = emb.double()
+        xy = E[xs] @ X.double() + E[ys] @ Y.double()
+        log_probs = (xy * E[zs]).sum(1) - th.logsumexp(xy @ E[1:].T, 1)
+        return (log_probs.sum() - B * l2 * (th.norm(X) + th.norm(Y))) / N
+
+    # Compare with autograd.
+    engine = LogLinearGradient(emb, X, Y, l2, batch_size=B)
+    F = engine.step(xs, ys, zs, N)
+    dX, dY = X.grad.clone(), Y.grad.clone()   # type: ignore
+    X.grad, Y.grad = None, None
+    F_autograd = objective(X, Y)
+    (-F_autograd).backward()
+    print(F, F_autograd.item())
+    assert abs(F - F_autograd.item()) < 1e-6
+    assert th.allclose(dX, X.grad, atol=1e-6) and th.allclose(dY, Y.grad, atol=1e-6)  # type: ignore
+
+    # Check the autograd gradients themselves against finite differences.
+    X64, Y64 = X.detach().double().requires_grad_(), Y.detach().double().requires_grad_()
+    assert th.autograd.gradcheck(objective, (X64, Y64))
+
+    # A smaller final batch uses part of the buffers.
+    engine.step(xs[:3], ys[:3], zs[:3], N)
+
+    # Take a few steps with the convergent optimizer.
+    from SGD_convergent import ConvergentSGD
+    optimizer = ConvergentSGD([X, Y], gamma0=0.5, lambda_=1)
+    for i in range(10):
+        value = engine.step(xs, ys, zs, N)
+        print(value)  # If everything is working, these values should be getting higher.
+        optimizer.step()
+
+
+if __name__ == "__main__":
+    test_me()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+A bounded cache for values that are expensive to recompute, such as the
+normalizing constants Z(xy) of a log-linear language model.
+"""
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    A dictionary that holds at most `maxsize` entries, discarding the least
+    recently used entry to make room for a new one.  It also counts the
+    hits and misses of `get`, so that we can tell whether it is big enough.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache["a"] = 1
+    >>> cache["b"] = 2
+    >>> cache.get("a"), cache.get("c")
+    (1, None)
+    >>> cache["c"] = 3        # evicts "b", which was used less recently than "a"
+    >>> "a" in cache, "b" in cache, len(cache)
+    (True, False, 2)
+    >>> cache.stats()
+    {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+    """
+
+    def __init__(self, maxsize: int = 2 ** 16) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"Invalid cache size: {maxsize}")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, V]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """The cached value for key (now the most recently used), or None."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key: Hashable, value: V) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)   # the least recently used entry
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Discard all the entries (but keep counting hits and misses)."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"size": len(self), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
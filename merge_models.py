@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Merges count-based language models that were trained on different shards
+of a corpus (with the same vocabulary and hyperparameters) into the model
+that training on all the shards together would give.  Since these models
+are nothing but n-gram counts, merging just sums the counts.
+
+So a big corpus can be trained on many machines at once: run train_lm.py
+on each shard, then merge the resulting models.  (But not models that
+prune their counts, with --min_count: they have already lost the rare
+n-grams of each shard, so their merge wouldn't be the model of the whole
+corpus.)
+"""
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+from ngram_counts import NgramCounts
+from probs import AddLambdaLanguageModel, BackoffAddLambdaLanguageModel, EmbeddingLogLinearLanguageModel, \
+    KneserNeyLanguageModel, LanguageModel, UniformLanguageModel, read_vocab
+
+log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "models",
+        type=Path,
+        nargs="+",
+        help="paths to the trained models to merge",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        required=True,
+        help="Where to save the merged model",
+    )
+
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        const=logging.DEBUG,
+        default=logging.INFO,
+    )
+    verbosity.add_argument(
+        "-q", "--quiet", dest="verbose", action="store_const", const=logging.WARNING
+    )
+
+    return parser.parse_args()
+
+
+def merge_models(lms: Sequence[LanguageModel]) -> LanguageModel:
+    """A model whose counts are the sums of the counts of lms, which must
+    all be count-based models of the same class, with the same vocab and
+    hyperparameters."""
+    first = lms[0]
+    if isinstance(first, EmbeddingLogLinearLanguageModel):
+        raise ValueError(f"Can't merge models of class {type(first).__name__}, which aren't made of counts")
+    if first.min_count > 1:
+        raise ValueError(f"Can't merge models that were pruned with min_count={first.min_count}, "
+                         f"since they have lost the counts of their rare n-grams")
+    for lm in lms[1:]:
+        if type(lm) is not type(first):
+            raise ValueError(f"Can't merge a {type(lm).__name__} with a {type(first).__name__}")
+        if lm.hyperparameters() != first.hyperparameters():
+            raise ValueError(f"Can't merge models with different hyperparameters: "
+                             f"{lm.hyperparameters()} and {first.hyperparameters()}")
+        if lm.vocab != first.vocab:
+            raise ValueError("Can't merge models with different vocabs")
+
+    merged = type(first)(first.vocab, **first.hyperparameters())
+    merged.use_counts(NgramCounts.merged([lm.counts for lm in lms], len(first.vocab), first.order))
+    merged.finalize()
+    return merged
+
+
+def test_me():
+    """Check that merging the models of the shards of a corpus gives the
+    same model as training on the whole corpus, for each count-based smoother."""
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(50)]
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        with open(directory / "vocab.txt", "w") as f:
+            print("\n".join(words[:40] + ["OOV", "EOS"]), file=f)   # the other words are OOV
+        vocab = read_vocab(directory / "vocab.txt")
+        shards = []
+        for i in range(3):
+            shards.append(directory / f"shard{i}.txt")
+            with open(shards[-1], "w") as f:
+                for _ in range(200):
+                    print(" ".join(rng.choice(words, size=rng.integers(0, 12))), file=f)
+
+        for make_lm in [lambda: UniformLanguageModel(vocab),
+                        lambda: AddLambdaLanguageModel(vocab, 0.5),
+                        lambda: BackoffAddLambdaLanguageModel(vocab, 0.5),
+                        lambda: KneserNeyLanguageModel(vocab),
+                        lambda: BackoffAddLambdaLanguageModel(vocab, 0.5, order=4),
+                        lambda: KneserNeyLanguageModel(vocab, order=4)]:
+            whole = make_lm()
+            whole.train(shards)
+            parts = []
+            for shard in shards:
+                parts.append(make_lm())
+                parts[-1].train(shard)
+            merged = merge_models(parts)
+
+            expected, got = whole.counts.arrays(), merged.counts.arrays()
+            assert sorted(expected) == sorted(got), type(whole).__name__
+            for name in expected:
+                assert np.array_equal(expected[name], got[name]), f"{type(whole).__name__}: {name} differs"
+            ngrams = rng.integers(len(vocab), size=(20, whole.order + 1))
+            assert np.array_equal(whole.log_prob_ngrams(ngrams), merged.log_prob_ngrams(ngrams))
+            if whole.order <= 3:
+                xs, ys = rng.integers(len(vocab), size=(2, 20))
+                assert np.array_equal(whole.next_word_distributions(xs, ys), merged.next_word_distributions(xs, ys))
+            print(f"{type(whole).__name__} of order {whole.order}: merged == monolithic")
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=args.verbose)
+
+    lms = [LanguageModel.load(model, mmap=True) for model in args.models]
+    log.info(f"Merging {len(lms)} models...")
+    merge_models(lms).save(destination=args.output)
+
+
+if __name__ == "__main__":
+    main()
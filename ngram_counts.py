@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Compact storage for the n-gram counts of a language model.
+
+The n-grams are tuples of integer word ids (see `integerize.py`), so
+instead of hashing tuples in a `Counter` we can store the counts in
+NumPy arrays:
+
+* The zerogram count is a single number and the unigram counts are a
+  dense array indexed by word id.
+
+* The n-grams of each higher order k are packed into 64-bit integer keys
+  w1*R^(k-1) + w2*R^(k-2) + ... + wk, where the radix R is the number of
+  distinct ids.  The keys are kept in a sorted array, with a parallel
+  array of counts, and we look an n-gram up by binary search.
+
+Sorting by key also sorts the n-grams lexicographically, so all the
+n-grams that share a prefix (e.g., all the trigrams with context xy)
+sit in one contiguous block of the arrays.  Once counting is done,
+`build_index` records where each context's block starts, as in the
+row pointers of a CSR sparse matrix, so that the observed successors of
+a context can be found without searching all the keys.
+
+Binary search is the right tool for looking up whole arrays of n-grams at
+once, but from Python, a single lookup costs more in NumPy's overhead than
+in the search itself.  So for single lookups, the store also builds (only
+when they are first needed) plain dicts from the keys of each order to
+their counts, which cost memory but are as quick as Python lookups get.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+Ngram = Tuple[int, ...]
+
+
+class NgramCounts:
+    """
+    Counts of all the n-grams of orders 0 through `max_order` over ids 0 ... radix-1.
+
+    >>> counts = NgramCounts(radix=5, max_order=2)
+    >>> counts.add(np.array([[1, 2], [1, 2], [3, 4]]))
+    >>> counts.add(np.array([[1], [3], [3]]))
+    >>> counts[1, 2], counts[3, 4], counts[4, 3], counts[3,], counts[2,]
+    (2, 1, 0, 2, 0)
+    >>> counts.lookup(np.array([[1, 2], [2, 1], [3, 4]]))
+    array([2, 0, 1])
+    """
+
+    def __init__(self, radix: int, max_order: int = 3) -> None:
+        if radix ** max_order >= 2 ** 63:
+            raise ValueError(f"Can't pack {max_order}-grams over {radix} word types into 64-bit keys")
+        self.radix = radix
+        self.max_order = max_order
+        # keys[k] and counts[k] hold the n-grams of order k.  We don't need
+        # keys for orders 0 and 1, whose counts are dense arrays.
+        self.keys: List[Optional[np.ndarray]] = [None, None]
+        self.counts: List[np.ndarray] = [np.zeros(1, dtype=np.int64), np.zeros(radix, dtype=np.int64)]
+        for _ in range(2, max_order + 1):
+            self.keys.append(np.zeros(0, dtype=np.int64))
+            self.counts.append(np.zeros(0, dtype=np.int64))
+        # index[k] = (contexts, offsets) locates the block of each context of
+        # the n-grams of order k > 1 (see `build_index`).  by_count lists the
+        # ids by decreasing unigram count.  Both are dropped when counts change.
+        self.index: Dict[int, Tuple[Optional[np.ndarray], np.ndarray]] = {}
+        self.by_count: Optional[np.ndarray] = None
+        # hashes[k] maps keys[k] to counts[k], and context_hashes[k] maps the
+        # contexts of index[k] to their positions (see `count` and
+        # `find_context`).  Like the index, they are built when first needed,
+        # and dropped when counts change.
+        self.hashes: Dict[int, Dict[int, int]] = {}
+        self.context_hashes: Dict[int, Dict[int, int]] = {}
+
+    def pack(self, ngrams: np.ndarray) -> np.ndarray:
+        """Pack each row of a 2-D array of n-grams into a single int64 key."""
+        order = ngrams.shape[1]
+        powers = self.radix ** np.arange(order - 1, -1, -1, dtype=np.int64)
+        return ngrams.astype(np.int64, copy=False) @ powers
+
+    def unpack(self, keys: np.ndarray, order: int) -> np.ndarray:
+        """Inverse of `pack`: the n-grams of the given order, as the rows of a 2-D array."""
+        ngrams = np.empty((len(keys), order), dtype=np.int64)
+        for i in range(order - 1, -1, -1):
+            keys, ngrams[:, i] = np.divmod(keys, self.radix)
+        return ngrams
+
+    def with_radix(self, radix: int) -> "NgramCounts":
+        """A copy of this store over more ids, 0 ... radix-1, for a vocab that
+        has grown.  The keys are re-encoded; they stay in sorted order, since
+        the n-grams themselves are unchanged.
+
+        >>> counts = NgramCounts(radix=3, max_order=2)
+        >>> counts.add(np.array([[1, 2], [2, 0]]))
+        >>> bigger = counts.with_radix(5)
+        >>> bigger[1, 2], bigger[2, 0], bigger.keys[2]
+        (1, 1, array([ 7, 10]))
+        """
+        if radix < self.radix:
+            raise ValueError(f"Can't shrink the ids of an NgramCounts from {self.radix} to {radix}")
+        store = NgramCounts(radix, self.max_order)
+        store.counts[0] = self.counts[0]
+        store.counts[1] = np.r_[self.counts[1], np.zeros(radix - self.radix, dtype=np.int64)]
+        for order in range(2, self.max_order + 1):
+            store.keys[order] = store.pack(self.unpack(self.keys[order], order))   # type: ignore
+            store.counts[order] = self.counts[order]
+        return store
+
+    def add(self, ngrams: np.ndarray, counts: Optional[np.ndarray] = None) -> None:
+        """Count the rows of `ngrams`, a 2-D array whose number of columns
+        is the order of the n-grams.  Each row is counted once, or counts[i]
+        times if `counts` is given."""
+        order = ngrams.shape[1]
+        if counts is None:
+            counts = np.ones(len(ngrams), dtype=np.int64)
+        # (We don't add in place, since the arrays may be read-only, e.g., loaded from disk.)
+        if order == 0:
+            self.counts[0] = self.counts[0] + counts.sum()
+        elif order == 1:
+            self.counts[1] = self.counts[1] + np.bincount(ngrams[:, 0], weights=counts, minlength=self.radix).astype(np.int64)
+            self.by_count = None
+        else:
+            self.keys[order], self.counts[order] = merge_counts(
+                self.keys[order], self.counts[order], self.pack(ngrams), counts)   # type: ignore
+            self.drop_index(order)
+
+    def add_counts(self, *others: "NgramCounts") -> None:
+        """Add all the counts of other stores over the same ids to this one,
+        sorting and reducing the keys of each order just once.
+
+        >>> a, b = NgramCounts(radix=5, max_order=2), NgramCounts(radix=5, max_order=2)
+        >>> a.add(np.array([[1, 2], [3, 4]]))
+        >>> b.add(np.array([[1, 2], [0, 1]]))
+        >>> a.add_counts(b)
+        >>> a.keys[2], a.counts[2]
+        (array([ 1,  7, 19]), array([1, 2, 1]))
+        """
+        for other in others:
+            if other.radix != self.radix or other.max_order != self.max_order:
+                raise ValueError(f"Can't add counts of {other.max_order}-grams over {other.radix} ids "
+                                 f"to counts of {self.max_order}-grams over {self.radix} ids")
+        self.counts[0] = self.counts[0] + sum(other.counts[0] for other in others)
+        self.counts[1] = self.counts[1] + sum(other.counts[1] for other in others)
+        self.by_count = None
+        for order in range(2, self.max_order + 1):
+            self.keys[order], self.counts[order] = sum_counts(
+                np.concatenate([self.keys[order]] + [other.keys[order] for other in others]),   # type: ignore
+                np.concatenate([self.counts[order]] + [other.counts[order] for other in others]))
+            self.drop_index(order)
+
+    def prune(self, min_count: int, min_order: int = 2) -> Dict[int, np.ndarray]:
+        """Drop the n-grams of orders min_order (at least 2) and up that were
+        counted fewer than min_count times.  Returns, for each of those orders,
+        a boolean mask of the entries of its arrays (as they were) that were
+        kept, so that callers can filter arrays that parallel them.
+
+        An n-gram is counted at most as often as its prefixes and suffixes
+        (as contexts, in the case of prefixes), so the n-grams that extend a
+        pruned one are pruned too.
+
+        >>> counts = NgramCounts(radix=5, max_order=3)
+        >>> counts.add(np.array([[1, 2, 3], [1, 2, 3], [1, 2, 4]]))
+        >>> counts.add(np.array([[1, 2], [1, 2], [1, 2]]))
+        >>> counts.prune(2)
+        {2: array([ True]), 3: array([ True, False])}
+        >>> counts[1, 2, 3], counts[1, 2, 4], counts[1, 2]
+        (2, 0, 3)
+        """
+        kept = {}
+        for order in range(max(2, min_order), self.max_order + 1):
+            keep = self.counts[order] >= min_count
+            self.keys[order] = self.keys[order][keep]   # type: ignore
+            self.counts[order] = self.counts[order][keep]
+            self.drop_index(order)
+            kept[order] = keep
+        return kept
+
+    @classmethod
+    def merged(cls,stores: Iterable["NgramCounts"], radix: int, max_order: int = 3) -> "NgramCounts":
+        """The sum of all the stores, which may be generated one at a time.
+        They're added in batches that are about as big as their running total,
+        so each n-gram takes part in only a logarithmic number of sorts."""
+        total = cls(radix, max_order)
+        pending: List[NgramCounts] = []
+        for store in stores:
+            pending.append(store)
+            if sum(len(p) for p in pending) >= len(total):
+                total.add_counts(*pending)
+                pending = []
+        total.add_counts(*pending)
+        return total
+
+    def drop_index(self, order: int) -> None:
+        """Forget the index and the hashes of an order whose keys have changed."""
+        self.index.pop(order, None)
+        self.hashes.pop(order, None)
+        self.context_hashes.pop(order, None)
+
+    def build_index(self) -> None:
+        """Index the blocks of n-grams that share a context, for `successors`.
+        For bigrams, the contexts are single ids, so offsets[y] is simply where
+        y's block starts (and offsets[y+1] where it ends).  For higher orders,
+        there are too many possible contexts for that, so we keep the sorted
+        array of the contexts that occur, and offsets[i] is where the block of
+        contexts[i] starts.  Also sorts the ids by count, for `top_successors`."""
+        for order in range(2, self.max_order + 1):
+            if order in self.index:
+                continue
+            prefixes = self.keys[order] // self.radix   # type: ignore
+            if order == 2:
+                self.index[order] = (None, prefixes.searchsorted(np.arange(self.radix + 1)))
+            else:
+                starts = np.flatnonzero(np.diff(prefixes, prepend=-1))   # where the context changes
+                self.index[order] = (prefixes[starts], np.r_[starts, len(prefixes)])
+        if self.by_count is None:
+            self.by_count = np.lexsort((np.arange(self.radix), -self.counts[1]))
+
+    def __getitem__(self, ngram: Ngram) -> int:
+        """The count of a single n-gram, which is a tuple of ids."""
+        order = len(ngram)
+        if order == 0:
+            return self.counts[0].item(0)
+        elif order == 1:
+            return self.counts[1].item(ngram[0])
+        key = 0
+        radix = self.radix
+        for w in ngram:
+            key = key * radix + w
+        return self.count(order, key)
+
+    def count(self, order: int, key: int) -> int:
+        """The count of a single packed n-gram of order > 1.
+
+        >>> counts = NgramCounts(radix=5, max_order=2)
+        >>> counts.add(np.array([[1, 2], [1, 2], [3, 4]]))
+        >>> counts.count(2, 1 * 5 + 2), counts.count(2, 3 * 5 + 4), counts.count(2, 4 * 5 + 3)
+        (2, 1, 0)
+        """
+        return (self.hashes.get(order) or self.hash_table(order)).get(key, 0)
+
+    def hash_table(self, order: int) -> Dict[int, int]:
+        """The dict from the packed keys of an order to their counts, built if
+        need be.  Hot loops can probe it directly, as
+        `(counts.hashes.get(order) or counts.hash_table(order)).get(key, 0)`,
+        which saves the call to `count`."""
+        hashes = self.hashes.get(order)
+        if hashes is None:
+            hashes = self.hashes[order] = dict(zip(self.keys[order].tolist(), self.counts[order].tolist()))   # type: ignore
+        return hashes
+
+    def find_context(self, order: int, key: int) -> int:
+        """Where a single packed context of n-grams of order > 2 is in the
+        contexts of index[order] (which must have been built), or -1 if
+        no n-gram extends it."""
+        hashes = self.context_hashes.get(order)
+        if hashes is None:
+            contexts = self.index[order][0]
+            hashes = self.context_hashes[order] = dict(zip(contexts.tolist(), range(len(contexts))))   # type: ignore
+        return hashes.get(key, -1)
+
+    def lookup(self, ngrams: np.ndarray) -> np.ndarray:
+        """Vectorized version of __getitem__: the counts of all the rows of a 2-D array of n-grams."""
+        order = ngrams.shape[1]
+        if order == 0:
+            return np.full(len(ngrams), self.counts[0][0])
+        elif order == 1:
+            return self.counts[1][ngrams[:, 0]]
+        keys, counts = self.keys[order], self.counts[order]
+        if len(keys) == 0:   # type: ignore
+            return np.zeros(len(ngrams), dtype=np.int64)
+        query = self.pack(ngrams)
+        i = np.minimum(keys.searchsorted(query), len(keys) - 1)   # type: ignore
+        return np.where(keys[i] == query, counts[i], 0)   # type: ignore
+
+    def successors(self, contexts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All the observed successors of each row of `contexts`, a 2-D array
+        of (n-1)-grams: that is, the words w such that the n-gram context+w
+        has a nonzero count.  Returns three parallel arrays: the row of the
+        context, the successor w, and the count of context+w.  The cost is
+        proportional to the number of successors, not to the vocabulary size,
+        since the n-grams that extend a context form one block of the keys.
+
+        >>> counts = NgramCounts(radix=5, max_order=2)
+        >>> counts.add(np.array([[1, 2], [1, 4], [1, 2], [3, 0]]))
+        >>> counts.successors(np.array([[1], [2], [3]]))
+        (array([0, 0, 2]), array([2, 4, 0]), array([2, 1, 1]))
+        >>> counts.build_index()
+        >>> counts.successors(np.array([[1], [2], [3]]))
+        (array([0, 0, 2]), array([2, 4, 0]), array([2, 1, 1]))
+        """
+        order = contexts.shape[1] + 1
+        if order == 1:   # every word extends the empty context
+            words = np.flatnonzero(self.counts[1])
+            return (np.repeat(np.arange(len(contexts)), len(words)), np.tile(words, len(contexts)),
+                    np.tile(self.counts[1][words], len(contexts)))
+        rows, positions = self.positions(contexts)
+        return rows, self.keys[order][positions] % self.radix, self.counts[order][positions]   # type: ignore
+
+    def positions(self, contexts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Where the observed n-grams that extend each row of `contexts` (a 2-D
+        array of (n-1)-grams, n > 1) are in the arrays of order n.  Returns two
+        parallel arrays: the row of the context, and the position of the n-gram.
+        This lets callers look up other arrays that parallel the keys."""
+        start, lengths = self.blocks(contexts)
+        rows = np.repeat(np.arange(len(contexts)), lengths)
+        # The positions start[i], start[i]+1, ..., start[i]+lengths[i]-1 for each row i, all concatenated.
+        return rows, np.arange(lengths.sum()) + np.repeat(start - (np.cumsum(lengths) - lengths), lengths)
+
+    def blocks(self, contexts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Where the block of n-grams that extend each row of `contexts` starts
+        in the arrays of their order, and how long it is (0 if the context
+        was never extended).  Uses the index if there is one."""
+        order = contexts.shape[1] + 1
+        keys = self.keys[order]
+        packed = self.pack(contexts)
+        if order not in self.index:
+            first = packed * self.radix
+            start = keys.searchsorted(first)   # type: ignore
+            return start, keys.searchsorted(first + self.radix) - start   # type: ignore
+        indexed, offsets = self.index[order]
+        if indexed is None:   # the contexts are single ids, which index the offsets directly
+            return offsets[packed], offsets[packed + 1] - offsets[packed]
+        i = indexed.searchsorted(packed)
+        found = i < len(indexed)
+        found[found] = indexed[i[found]] == packed[found]
+        i = np.where(found, i, 0)
+        return offsets[i], np.where(found, offsets[i + 1] - offsets[i], 0)
+
+    def top_successors(self, context: Ngram, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The (at most) k most frequent successors of a single context, with
+        their counts, in decreasing order of count (ties go to the lower id).
+
+        >>> counts = NgramCounts(radix=5, max_order=2)
+        >>> counts.add(np.array([[1, 2], [1, 4], [1, 2], [1, 3], [3, 0]]))
+        >>> counts.top_successors((1,), 2)
+        (array([2, 3]), array([2, 1]))
+        """
+        if len(context) == 0:
+            if self.by_count is None:
+                self.build_index()
+            words = self.by_count[:k]   # type: ignore
+            words = words[self.counts[1][words] > 0]
+            return words, self.counts[1][words]
+        _, words, counts = self.successors(np.array([context], dtype=np.int64))
+        best = np.lexsort((words, -counts))[:k]
+        return words[best], counts[best]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """All the arrays of this store, by name, for saving (see `from_arrays`),
+        including the index if it has been built."""
+        arrays = {f"counts{k}": counts for k, counts in enumerate(self.counts)}
+        arrays.update({f"keys{k}": keys for k, keys in enumerate(self.keys) if keys is not None})
+        for k, (contexts, offsets) in self.index.items():
+            arrays[f"offsets{k}"] = offsets
+            if contexts is not None:
+                arrays[f"contexts{k}"] = contexts
+        if self.by_count is not None:
+            arrays["by_count"] = self.by_count
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, radix: int, arrays: Dict[str, np.ndarray]) -> "NgramCounts":
+        """Reassemble a store from the arrays returned by `arrays` (which
+        are used as they are, not copied)."""
+        max_order = max(int(name[len("counts"):]) for name in arrays if name.startswith("counts"))
+        store = cls(radix, max_order)
+        store.counts = [arrays[f"counts{k}"] for k in range(max_order + 1)]
+        store.keys = [None, None] + [arrays[f"keys{k}"] for k in range(2, max_order + 1)]
+        store.index = {k: (arrays.get(f"contexts{k}"), arrays[f"offsets{k}"])
+                       for k in range(2, max_order + 1) if f"offsets{k}" in arrays}
+        store.by_count = arrays.get("by_count")
+        if len(store.counts[1]) != radix:
+            raise ValueError(f"Expected {radix} unigram counts, got {len(store.counts[1])}")
+        return store
+
+    def __getstate__(self) -> dict:
+        # The hashes are quick to rebuild, and would only bloat the file.
+        return {**self.__dict__, "hashes": {}, "context_hashes": {}}
+
+    def __setstate__(self, state: dict) -> None:
+        # Stores pickled before there was an index don't have one yet.
+        self.__dict__.update({"index": {}, "by_count": None, "hashes": {}, "context_hashes": {}, **state})
+
+    def __len__(self) -> int:
+        """Number of n-gram types with nonzero counts."""
+        return 1 + int(np.count_nonzero(self.counts[1])) + sum(len(c) for c in self.counts[2:])
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays."""
+        return (sum(c.nbytes for c in self.counts) + sum(k.nbytes for k in self.keys if k is not None)
+                + sum(a.nbytes for index in self.index.values() for a in index if a is not None)
+                + (self.by_count.nbytes if self.by_count is not None else 0))
+
+
+def merge_counts(keys1: np.ndarray, counts1: np.ndarray,
+                 keys2: np.ndarray, counts2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge two arrays of keys with their counts into one sorted array of
+    unique keys, summing the counts of keys that appear more than once."""
+    return sum_counts(np.concatenate([keys1, keys2]), np.concatenate([counts1, counts2]))
+
+
+def sum_counts(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort the keys, summing the counts of keys that appear more than once."""
+    counts = counts.astype(np.int64, copy=False)
+    if len(keys) == 0:
+        return keys, counts
+    order = np.argsort(keys, kind="stable")
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+class CountView:
+    """
+    Read-only, Counter-like view of an `NgramCounts` that reports a count of 0
+    for every n-gram ending in the id `excluded`.  This lets one store serve as
+    two different count functions that agree on all other n-grams.
+    """
+
+    def __init__(self, counts: NgramCounts, excluded: int) -> None:
+        self.counts = counts
+        self.excluded = excluded
+
+    def __getitem__(self, ngram: Ngram) -> int:
+        if ngram and ngram[-1] == self.excluded:
+            return 0
+        return self.counts[ngram]
+
+    def lookup(self, ngrams: np.ndarray) -> np.ndarray:
+        """Vectorized version of __getitem__, like `NgramCounts.lookup`."""
+        counts = self.counts.lookup(ngrams)
+        if ngrams.shape[1] > 0:
+            counts[ngrams[:, -1] == self.excluded] = 0
+        return counts
+
+    def successors(self, contexts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Like `NgramCounts.successors`, but without the successor `excluded`."""
+        rows, words, counts = self.counts.successors(contexts)
+        keep = words != self.excluded
+        return rows[keep], words[keep], counts[keep]
+
+    def top_successors(self, context: Ngram, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `NgramCounts.top_successors`, but without the successor `excluded`."""
+        words, counts = self.counts.top_successors(context, k + 1)
+        keep = words != self.excluded
+        return words[keep][:k], counts[keep][:k]
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
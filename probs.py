@@ -19,16 +19,39 @@ import random
 import numpy as np
 from tqdm import trange
 import tqdm
+import bz2
+import glob
+import gzip
+import io
+import itertools
+import functools
+import json
+import lzma
 import math
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import struct
+import threading
+from collections import deque
+
+from integerize import Integerizer
+from loglinear_gradient import LogLinearGradient
+from lru import LRUCache
+from ngram_counts import CountView, NgramCounts
+import profiling
 
 
 log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
 
 ##### TYPE DEFINITIONS (USED FOR TYPE ANNOTATIONS)
-from typing import Iterable, List, Optional, Set, Tuple, Union
+from typing import (Any, BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Set,
+                    TextIO, Tuple, TypeVar, Union)
 
-Wordtype = str  # if you decide to integerize the word types, then change this to int
-Vocab    = Set[Wordtype]
+Word     = str  # a word type as it is spelled in our text files
+Wordtype = int  # word types are integerized by looking them up in the vocab
+Vocab    = Integerizer[Word]
 Zerogram = Tuple[()]
 Unigram  = Tuple[Wordtype]
 Bigram   = Tuple[Wordtype, Wordtype]
@@ -38,10 +61,17 @@ Vector   = List[float]
 
 
 ##### CONSTANTS
-BOS: Wordtype = "BOS"  # special word type for context at Beginning Of Sequence
-EOS: Wordtype = "EOS"  # special word type for observed token at End Of Sequence
-OOV: Wordtype = "OOV"  # special word type for all Out-Of-Vocabulary words
-OOL: Wordtype = "OOL"  # special word type whose embedding is used for OOV and all other Out-Of-Lexicon words
+BOS: Word = "BOS"  # special word type for context at Beginning Of Sequence
+EOS: Word = "EOS"  # special word type for observed token at End Of Sequence
+OOV: Word = "OOV"  # special word type for all Out-Of-Vocabulary words
+OOL: Word = "OOL"  # special word type whose embedding is used for OOV and all other Out-Of-Lexicon words
+
+# `read_vocab` puts the special word types first, so they get the same integer
+# ids in every vocab.  BOS gets id 0 even though it is never a possible outcome
+# (only a context); all the possible outcomes z have ids 1, 2, ..., vocab_size.
+BOS_ID: Wordtype = 0
+EOS_ID: Wordtype = 1
+OOV_ID: Wordtype = 2
 
 ##### read lexicon class
 class Lexicon:
@@ -69,6 +99,15 @@ class Lexicon:
 
 	@classmethod
 	def from_file(cls, file: Path) -> Lexicon:
+		"""Read a lexicon, either in the binary format of `save_binary`
+		(fast) or in the original text format (slow)."""
+		with open(file, "rb") as f:
+			if f.read(len(LEXICON_MAGIC)) == LEXICON_MAGIC:
+				return cls.from_binary_file(file)
+		return cls.from_text_file(file)
+
+	@classmethod
+	def from_text_file(cls, file: Path) -> Lexicon:
         # FINISH THIS FUNCTION
 		lines = []
 		count = 0
@@ -84,21 +123,54 @@ class Lexicon:
 				int_to_word[count]=line[0]
 				word_to_int[line[0]]=count
 				count+=1
-		embeddings = torch.tensor(lines, dtype=torch.float64)
+		embeddings = torch.from_numpy(np.array(lines, dtype=np.float64))  # one copy, not one per row
 		lexicon = Lexicon(int_to_word,word_to_int, embeddings)  # Maybe put args here. Maybe follow Builder pattern
 		return lexicon
 
+	@classmethod
+	def from_binary_file(cls, file: Path) -> Lexicon:
+		"""Open a lexicon saved by `save_binary`.  The embedding matrix is
+		memory-mapped rather than read, so this takes no time and processes
+		that open the same file share its pages.  (The mapping is
+		copy-on-write, so the file itself can never be modified.)"""
+		with open(file, "rb") as f:
+			_, num_words, dim, words_offset = LEXICON_HEADER.unpack(f.read(LEXICON_HEADER.size))
+			f.seek(words_offset)
+			words = f.read().decode("utf-8").split("\n")
+		if len(words) != num_words:
+			raise ValueError(f"Lexicon {file} is corrupt: expected {num_words} words, found {len(words)}")
+		matrix = np.memmap(file, dtype=np.float32, mode="c", offset=LEXICON_HEADER.size, shape=(num_words, dim))
+		word_to_int = {word: i for i, word in enumerate(words)}
+		return Lexicon(dict(enumerate(words)), word_to_int, torch.from_numpy(matrix))
+
+	def save_binary(self, file: Path) -> None:
+		"""Save this lexicon in a binary format that `from_file` can open
+		without parsing: a fixed-size header, then the embeddings as a
+		float32 matrix, then the words, one per line."""
+		matrix = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+		words = "\n".join(self.int_to_word[i] for i in range(len(matrix))).encode("utf-8")
+		num_words, dim = matrix.shape
+		with open(file, "wb") as f:
+			f.write(LEXICON_HEADER.pack(LEXICON_MAGIC, num_words, dim, LEXICON_HEADER.size + matrix.nbytes))
+			f.write(matrix.tobytes())
+			f.write(words)
+
+
+# Header of the binary lexicon format: a magic string, the number of words,
+# the dimensionality, and the byte offset of the word list.  The header is
+# 32 bytes long, so the float32 matrix that follows it is aligned.
+LEXICON_MAGIC = b"LEXICON1"
+LEXICON_HEADER = struct.Struct("<8sqqq")
+
 
 
 ##### UTILITY FUNCTIONS FOR CORPUS TOKENIZATION
 
-def read_tokens(file: Path, vocab: Optional[Vocab] = None) -> Iterable[Wordtype]:
+def read_tokens(file: Path, vocab: Optional[Vocab] = None) -> Iterable[Union[Word, Wordtype]]:
     """Iterator over the tokens in file.  Tokens are whitespace-delimited.
-    If vocab is given, then tokens that are not in vocab are replaced with OOV."""
-
-    # OPTIONAL SPEEDUP: You may want to modify this to integerize the
-    # tokens, using integerizer.py as in previous homeworks.
-    # In that case, redefine `Wordtype` from `str` to `int`.
+    If vocab is given, then each token is integerized by looking it up in vocab,
+    and tokens that are not in vocab are replaced with OOV.  Otherwise the
+    tokens are returned as strings (this is how we build a vocab in the first place)."""
 
     # PYTHON NOTE: This function uses `yield` to return the tokens one at
     # a time, rather than constructing the whole sequence and using
@@ -114,14 +186,23 @@ def read_tokens(file: Path, vocab: Optional[Vocab] = None) -> Iterable[Wordtype]
     # Whenever the `for` loop needs another token, read_tokens picks up where it
     # left off and continues running until the next `yield` statement.
 
-    with open(file) as f:
-        for line in f:
-            for token in line.split():
-                if vocab is None or token in vocab:
-                    yield token
-                else:
-                    yield OOV  # replace this out-of-vocabulary word with OOV
-            yield EOS  # Every line in the file implicitly ends with EOS.
+    with open_corpus_file(file) as f:
+        if vocab is None:
+            for line in f:
+                yield from line.split()
+                yield EOS  # Every line in the file implicitly ends with EOS.
+        else:
+            yield from integerize_lines(f, vocab)
+
+
+def integerize_lines(lines: Iterable[str], vocab: Vocab) -> Iterable[Wordtype]:
+    """The tokens of the lines, integerized as by `read_tokens`."""
+    index = vocab.index
+    for line in lines:
+        for token in line.split():
+            i = index(token)
+            yield OOV_ID if i is None else i  # replace an out-of-vocabulary word with OOV
+        yield EOS_ID  # Every line in the file implicitly ends with EOS.
 
 
 def num_tokens(file: Path) -> int:
@@ -131,16 +212,275 @@ def num_tokens(file: Path) -> int:
 
 def read_trigrams(file: Path, vocab: Vocab) -> Iterable[Trigram]:
     """Iterator over the trigrams in file.  Each triple (x,y,z) is a token z
-    (possibly EOS) with a left context (x,y)."""
-    x, y = BOS, BOS
+    (possibly EOS) with a left context (x,y), as integer ids in vocab."""
+    x, y = BOS_ID, BOS_ID
     for z in read_tokens(file, vocab):
         yield (x, y, z)
-        if z == EOS:
-            x, y = BOS, BOS  # reset for the next sequence in the file (if any)
+        if z == EOS_ID:
+            x, y = BOS_ID, BOS_ID  # reset for the next sequence in the file (if any)
         else:
             x, y = y, z  # shift over by one position.
 
 
+def read_trigram_arrays(file: Path, vocab: Vocab) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """All the trigrams in file, as three parallel arrays xs, ys, zs of ids.
+    This gives the same trigrams as `read_trigrams`, in the same order."""
+    return trigram_arrays(np.fromiter(read_tokens(file, vocab), dtype=np.int64))
+
+
+def trigram_arrays(zs: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The arrays xs, ys, zs of `read_trigram_arrays`, given just the array
+    zs of integerized tokens (one sentence after another, each ending in EOS)."""
+    xs, ys, zs = ngram_arrays(zs, 3).T
+    return xs, ys, zs
+
+
+def read_ngram_arrays(file: Path, vocab: Vocab, order: int) -> np.ndarray:
+    """Like `read_trigram_arrays`, but for n-grams of any order: a 2-D array
+    whose rows are the n-grams, each a token with its left context."""
+    return ngram_arrays(np.fromiter(read_tokens(file, vocab), dtype=np.int64), order)
+
+
+def ngram_arrays(zs: np.ndarray, order: int) -> np.ndarray:
+    """The n-grams of `read_ngram_arrays`, given just the array zs of
+    integerized tokens (one sentence after another, each ending in EOS).
+
+    >>> ngram_arrays(np.array([5, 6, EOS_ID, 7, EOS_ID]), 4)
+    array([[0, 0, 0, 5],
+           [0, 0, 5, 6],
+           [0, 5, 6, 1],
+           [0, 0, 0, 7],
+           [0, 0, 7, 1]])
+    """
+    ngrams = np.empty((len(zs), order), dtype=np.int64)
+    if len(zs) == 0:
+        return ngrams
+    # Shift each column right by one position to get the column before it,
+    # resetting the context to BOS ... BOS after each EOS.
+    reset = np.r_[True, zs[:-1] == EOS_ID]
+    ngrams[:, -1] = zs
+    for i in range(order - 2, -1, -1):
+        ngrams[1:, i] = ngrams[:-1, i + 1]
+        ngrams[reset, i] = BOS_ID
+    return ngrams
+
+
+##### READING A CORPUS IN CHUNKS, IN PARALLEL
+#
+# A corpus may be many files, some of them compressed.  It is split into
+# chunks of whole lines.  Since every line is a separate sentence, the
+# trigrams of the corpus are just the trigrams of its chunks, one chunk
+# after another, so the chunks can be integerized and counted
+# independently, by several processes at once.
+#
+# A chunk of an uncompressed file is just a range of byte offsets, which
+# the worker that gets it reads for itself.  A compressed file has to be
+# decompressed from the start, so it is decompressed by a background
+# thread of the main process, which hands the decompressed lines
+# themselves to the workers.
+
+Corpus = Union[Path, str, Sequence[Union[Path, str]]]   # files, directories, or glob patterns
+Chunk = Union[Tuple[Path, int, int], bytes]   # a file and the byte offsets where a chunk of its lines
+                                              # starts and ends, or the bytes of the lines themselves
+
+# The vocab of a worker process of `map_chunks` (see `_init_chunk_worker`).
+_worker_vocab: Optional[Vocab] = None
+
+
+def _open_zstd(file: Path) -> BinaryIO:
+    try:
+        import zstandard   # only needed for .zst files
+    except ImportError:
+        raise ImportError(f"Reading {file} requires the zstandard package (pip install zstandard)") from None
+    return zstandard.open(file, "rb")
+
+
+# How to open each kind of compressed file for reading, by its suffix.
+DECOMPRESSORS: Dict[str, Callable[[Path], BinaryIO]] = {
+    ".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open, ".lzma": lzma.open, ".zst": _open_zstd,
+}
+
+
+def open_corpus_file(file: Path) -> TextIO:
+    """Open a file of the corpus as text, decompressing it if its suffix says it's compressed."""
+    decompressor = DECOMPRESSORS.get(Path(file).suffix)
+    if decompressor is None:
+        return open(file)
+    return io.TextIOWrapper(decompressor(file))   # decodes the same way as `open(file)`
+
+
+def corpus_files(corpus: Corpus) -> List[Path]:
+    """The files of a corpus, which is given as a file, a directory (all the
+    files under it, except hidden ones), or a glob pattern, or a list of these."""
+    sources = [corpus] if isinstance(corpus, (Path, str)) else corpus
+    files: List[Path] = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            matches = sorted(p for p in path.rglob("*") if p.is_file() and not p.name.startswith("."))
+        elif path.exists():
+            matches = [path]
+        else:
+            matches = sorted(Path(p) for p in glob.glob(str(source), recursive=True) if os.path.isfile(p))
+        if not matches:
+            raise FileNotFoundError(f"No corpus files match {source}")
+        files.extend(matches)
+    return files
+
+
+def corpus_chunks(corpus: Corpus, chunk_bytes: int = 2 ** 24) -> Iterator[Chunk]:
+    """All the chunks of all the files of a corpus, in order.  (The files are
+    found right away, so that a missing one is reported before any work is done.)"""
+    files = corpus_files(corpus)
+
+    def chunks() -> Iterator[Chunk]:
+        for file in files:
+            if file.suffix in DECOMPRESSORS:
+                yield from decompressed_chunks(file, chunk_bytes)
+            else:
+                yield from line_chunks(file, chunk_bytes)
+
+    return chunks()
+
+
+def line_chunks(file: Path, chunk_bytes: int = 2 ** 24) -> List[Chunk]:
+    """Split file into chunks of about chunk_bytes each (or a little more),
+    each ending at the end of a line."""
+    size = os.path.getsize(file)
+    bounds = [0]
+    with open(file, "rb") as f:
+        while bounds[-1] < size:
+            f.seek(bounds[-1] + chunk_bytes - 1)
+            f.readline()   # up to the end of the line that we landed in
+            bounds.append(min(f.tell(), size))
+    return [(file, start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+def decompressed_chunks(file: Path, chunk_bytes: int = 2 ** 24) -> Iterator[bytes]:
+    """The lines of a compressed file, in chunks of about chunk_bytes (or a
+    little more), each ending at the end of a line.  The file is read and
+    decompressed by a background thread, in blocks of chunk_bytes, while
+    the caller works on the previous chunks.  (The decompressors release
+    the GIL while they work.)"""
+    blocks: queue.Queue = queue.Queue(maxsize=4)   # how far ahead the thread may get
+
+    def decompress() -> None:
+        try:
+            with DECOMPRESSORS[file.suffix](file) as f:
+                while True:
+                    block = f.read(chunk_bytes)
+                    blocks.put(block)
+                    if not block:   # the end of the file
+                        return
+        except Exception as e:   # re-raised in the caller's thread
+            blocks.put(e)
+
+    threading.Thread(target=decompress, daemon=True).start()
+    partial = b""   # the start of a line that continues in the next block
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        if not block:
+            break
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            partial += block
+        else:
+            yield partial + block[:end]
+            partial = block[end:]
+    if partial:
+        yield partial   # the last line, which has no newline
+
+
+def chunk_lines(chunk: Chunk) -> TextIO:
+    """The lines of a chunk, as text."""
+    if isinstance(chunk, bytes):
+        data = chunk
+    else:
+        file, start, end = chunk
+        with open(file, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+    return io.TextIOWrapper(io.BytesIO(data))   # decodes the same way as `open(file)`
+
+
+def read_chunk(chunk: Chunk, vocab: Vocab) -> np.ndarray:
+    """The integerized tokens of a chunk, the same as `read_tokens` gives for those lines."""
+    return np.fromiter(integerize_lines(chunk_lines(chunk), vocab), dtype=np.int64)
+
+
+def count_oov_chunk(chunk: Chunk, vocab: Vocab) -> Counter[Word]:
+    """How many times each word that isn't in the vocab occurs in a chunk."""
+    index = vocab.index
+    return Counter(token for line in chunk_lines(chunk) for token in line.split() if index(token) is None)
+
+
+def count_chunk(chunk: Chunk, vocab: Vocab, order: int = 3) -> NgramCounts:
+    """The n-gram counts of a chunk, as `count_ngrams` counts them."""
+    counts = NgramCounts(len(vocab), order)
+    count_ngrams(counts, ngram_arrays(read_chunk(chunk, vocab), order))
+    return counts
+
+
+T = TypeVar("T")
+
+
+def map_chunks(function: Callable[[Chunk, Any], T], chunks: Iterable[Chunk],
+               vocab: Optional[Vocab], jobs: int = 1) -> Iterator[T]:
+    """Yield function(chunk, vocab) for each of the chunks, in order,
+    using a pool of `jobs` processes if jobs > 1 (see scoring.py).
+    (The vocab may be None, for a function that reads words without integerizing them.)
+    The function must be defined at the top level of a module.
+    The chunks are consumed only a few at a time per worker, so that
+    decompressed chunks don't pile up in memory."""
+    if jobs <= 1:
+        for chunk in chunks:
+            yield function(chunk, vocab)
+        return
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    context = multiprocessing.get_context(start_method)
+    with context.Pool(jobs, initializer=_init_chunk_worker, initargs=(vocab,)) as pool:
+        pending: Deque[multiprocessing.pool.AsyncResult] = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_call_chunk_worker, ((function, chunk),)))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def _init_chunk_worker(vocab: Optional[Vocab]) -> None:
+    global _worker_vocab
+    _worker_vocab = vocab
+
+
+def _call_chunk_worker(task: Tuple[Callable[[Chunk, Any], T], Chunk]) -> T:
+    function, chunk = task
+    return function(chunk, _worker_vocab)
+
+
+def count_trigrams(counts: NgramCounts, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray) -> None:
+    """Record one token of each trigram (xs[i], ys[i], zs[i]) in counts, and
+    also of its suffixes (for backoff), as well as of its CONTEXT portion.
+    (See `LanguageModel.use_counts` for how a model reads these counts.)"""
+    count_ngrams(counts, np.stack([xs, ys, zs], axis=1))
+
+
+def count_ngrams(counts: NgramCounts, ngrams: np.ndarray) -> None:
+    """Like `count_trigrams`, for the rows of a 2-D array of n-grams of any order."""
+    order = ngrams.shape[1]
+    for k in range(order, -1, -1):
+        counts.add(ngrams[:, order - k:])
+    if order < 2:
+        return
+    # All the suffixes of the context were just counted as events,
+    # except the ones that end in BOS, which can't be events.
+    start = ngrams[:, -2] == BOS_ID
+    for k in range(order - 1, 0, -1):
+        counts.add(ngrams[start, order - 1 - k:order - 1])
+
+
 def draw_trigrams_forever(file: Path, 
                           vocab: Vocab, 
                           randomize: bool = False) -> Iterable[Trigram]:
@@ -166,26 +506,35 @@ def draw_trigrams_forever(file: Path,
 ##### READ IN A VOCABULARY (e.g., from a file created by build_vocab.py)
 
 def read_vocab(vocab_file: Path) -> Vocab:
-    vocab: Vocab = set()
+    vocab: Vocab = Integerizer([BOS, EOS, OOV])  # special types first, so that their ids are fixed
     with open(vocab_file, "rt") as f:
         for line in f:
-            word = line.strip()
+            word = line.split("\t", 1)[0].strip()   # build_vocab.py also writes each word's count after a tab
             vocab.add(word)
-    log.info(f"Read vocab of size {len(vocab)} from {vocab_file}")
+    log.info(f"Read vocab of size {len(vocab) - 1} from {vocab_file}")  # not counting BOS
     return vocab
 
 ##### LANGUAGE MODEL PARENT CLASS
 
 class LanguageModel:
-
-    def __init__(self, vocab: Vocab):
+    # The n-gram order: the model's probability for a word depends on the
+    # order-1 words before it.  Most of our models are trigram models, but
+    # the backoff and Kneser-Ney smoothers can be trained for other orders.
+    order: int = 3
+    # The models that prune their counts drop the n-grams of order 3 and up
+    # that were counted fewer than min_count times (see `prune`).
+    min_count: int = 1
+
+    def __init__(self, vocab: Vocab, order: int = 3):
         super().__init__()
 
         self.vocab = vocab
+        self.order = order
         self.progress = 0   # To print progress.
 
-        self.event_count:   Counter[Ngram] = Counter()  # numerator c(...) function.
-        self.context_count: Counter[Ngram] = Counter()  # denominator c(...) function.
+        self.use_counts(NgramCounts(len(vocab), order))
+        # This gives us two count functions, `event_count` and `context_count`,
+        # that share a single store (see below).
         # In this program, the argument to the counter should be an Ngram, 
         # which is always a tuple of Wordtypes, never a single Wordtype:
         # Zerogram: context_count[()]
@@ -197,7 +546,7 @@ class LanguageModel:
     @property
     def vocab_size(self) -> int:
         assert self.vocab is not None
-        return len(self.vocab)
+        return len(self.vocab) - 1  # BOS has an id in the vocab, but it is not a possible outcome
 
     # We need to collect two kinds of n-gram counts.
     # To compute p(z | xy) for a trigram xyz, we need c(xy) for the 
@@ -223,26 +572,33 @@ class LanguageModel:
     # Likewise, c(y) and c(z) count the training unigrams slightly differently.
     #
     # Note: For bigrams and unigrams that don't include BOS or EOS -- which
-    # is most of them! -- `event_count` and `context_count` will give the
-    # same value.  So you could save about half the memory if you were
-    # careful to store those cases only once.  (How?)  That would make the
-    # code slightly more complicated, but would be worth it in a real system.
-
-    def count_trigram_events(self, trigram: Trigram) -> None:
-        """Record one token of the trigram and also of its suffixes (for backoff)."""
-        (x, y, z) = trigram
-        self.event_count[(x, y, z )] += 1
-        self.event_count[   (y, z )] += 1
-        self.event_count[      (z,)] += 1  # the comma is necessary to make this a tuple
-        self.event_count[        ()] += 1
-
-    def count_trigram_contexts(self, trigram: Trigram) -> None:
-        """Record one token of the trigram's CONTEXT portion, 
-        and also the suffixes of that context (for backoff)."""
-        (x, y, _) = trigram    # we don't care about z
-        self.context_count[(x, y )] += 1
-        self.context_count[   (y,)] += 1
-        self.context_count[     ()] += 1
+    # is most of them! -- `event_count` and `context_count` give the same
+    # value.  In fact the two only ever disagree on n-grams that end in BOS
+    # (which can only be contexts) or in EOS (which can only be events).
+    # So we store each n-gram's count only once, in `self.counts`, and
+    # `event_count` and `context_count` are two views of that store that
+    # report 0 for n-grams ending in BOS and EOS respectively.
+
+    # The names of any arrays that a subclass's `finalize` precomputes from
+    # the counts.  They're saved with the model, and dropped whenever the
+    # counts change, until `finalize` computes them again.
+    PRECOMPUTED: List[str] = []
+    # Whether the model scores n-grams by binary search in its counts,
+    # which is much faster when the n-grams come sorted (see `scoring.Scorer`).
+    SORTED_LOOKUPS: bool = False
+
+    def use_counts(self, counts: NgramCounts) -> None:
+        """Make `counts` the store behind `event_count` and `context_count`."""
+        self.counts = counts
+        self.event_count   = CountView(counts, excluded=BOS_ID)  # numerator c(...) function.
+        self.context_count = CountView(counts, excluded=EOS_ID)  # denominator c(...) function.
+        for name in self.PRECOMPUTED:
+            setattr(self, name, None)   # stale now
+
+    def is_precomputed(self) -> bool:
+        """Whether the arrays in PRECOMPUTED are up to date.  (Models that
+        were pickled before they had these arrays don't have them at all.)"""
+        return all(getattr(self, name, None) is not None for name in self.PRECOMPUTED)
 
     def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
         """Computes a smoothed estimate of the trigram probability p(z | x,y)
@@ -255,13 +611,157 @@ class LanguageModel:
             f"{class_name}.prob is not implemented yet (you should override LanguageModel.prob)"
         )
 
+    def log_prob_batch(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray) -> np.ndarray:
+        """Computes log p(zs[i] | xs[i], ys[i]) for all the trigrams given by
+        three parallel arrays of ids, as returned by `read_trigram_arrays`.
+        Subclasses should override this with a vectorized version; this
+        default just calls `prob` on one trigram at a time.
+        """
+        return np.log([self.prob(x, y, z) for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist())])
+
+    def log_prob_ngrams(self, ngrams: np.ndarray) -> np.ndarray:
+        """Computes log p(w | h) for each row h w of a 2-D array of n-grams,
+        as returned by `read_ngram_arrays`.  Only the last `order` columns
+        are used, so there may be more.  This is how models of any order
+        are scored; by default, it scores the last three columns with
+        `log_prob_batch`, which is right for trigram models."""
+        if ngrams.shape[1] < self.order:
+            raise ValueError(f"A model of order {self.order} can't score {ngrams.shape[1]}-grams")
+        return self.log_prob_batch(ngrams[:, -3], ngrams[:, -2], ngrams[:, -1])
+
+    def trigram_histories(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """The histories that a model of order at most 3 conditions on, given
+        the contexts xy of trigrams, for the methods that take trigrams."""
+        if self.order > 3:
+            raise ValueError(f"A model of order {self.order} needs more than two words of context")
+        return np.stack([xs, ys], axis=1)[:, 3 - self.order:]
+
+    # A saved model is a directory that holds
+    #   meta.json   -- the format version, the model's class, and its hyperparameters
+    #   vocab.txt   -- the word types, one per line, in order of their ids
+    #   *.npy       -- the model's arrays (see `arrays`), such as its n-gram counts
+    # plus any other files that the class needs (see `save_extra`).
+    # Loading it takes time proportional to the size of the vocab, not of
+    # the model, and runs no code from the file, unlike unpickling.
+    MODEL_FORMAT_VERSION = 1
+
+    def hyperparameters(self) -> Dict[str, Any]:
+        """The keyword arguments, other than the vocab, that reconstruct this
+        model (before training).  Subclasses with hyperparameters should extend this."""
+        return {}
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The arrays that hold what the model learned in training, by name.
+        Subclasses with other parameters should extend this and `use_arrays`."""
+        arrays = self.counts.arrays()
+        if self.is_precomputed():
+            arrays.update({name: getattr(self, name) for name in self.PRECOMPUTED})
+        return arrays
+
+    def use_arrays(self, arrays: Dict[str, np.ndarray]) -> None:
+        """Inverse of `arrays`: install arrays that were saved from a trained model."""
+        self.use_counts(NgramCounts.from_arrays(len(self.vocab), arrays))
+        if all(name in arrays for name in self.PRECOMPUTED):   # else `finalize` will compute them
+            for name in self.PRECOMPUTED:
+                setattr(self, name, arrays[name])
+
+    def save_extra(self, directory: Path) -> Dict[str, Path]:
+        """Save any files other than arrays that reconstructing the model requires,
+        and return the extra keyword arguments that refer to them."""
+        return {}
+
     @classmethod
-    def load(cls, source: Path) -> "LanguageModel":
-        import pickle  # for loading/saving Python objects
+    def load(cls, source: Path, mmap: bool = False) -> "LanguageModel":
+        """Load a saved model.  If mmap is true, the model's arrays are
+        memory-mapped from their files instead of read into memory.  This
+        makes loading nearly instant, and all processes that load the same
+        model share one copy of it (in the operating system's page cache).
+        The files are opened copy-on-write, so they are never modified."""
         log.info(f"Loading model from {source}")
-        with open(source, mode="rb") as f:
-            log.info(f"Loaded model from {source}")
-            return pickle.load(f)
+        with profiling.timer("load"):
+            if Path(source).is_dir():
+                lm = cls.load_directory(Path(source), mmap)
+            else:
+                import pickle  # for loading models that were saved in the old format
+                with open(source, mode="rb") as f:
+                    lm = pickle.load(f)
+                if not isinstance(lm.vocab, Integerizer):
+                    lm.integerize_legacy()
+            lm.finalize()   # models saved before there was an index don't have one yet
+        profiling.instrument(lm)   # (only if profiling is enabled)
+        log.info(f"Loaded model from {source}")
+        return lm
+
+    @classmethod
+    def load_directory(cls, directory: Path, mmap: bool = False) -> "LanguageModel":
+        with open(directory / "meta.json") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != cls.MODEL_FORMAT_VERSION:
+            raise ValueError(f"Model {directory} has format version {meta.get('format_version')}, "
+                             f"but we can only read version {cls.MODEL_FORMAT_VERSION}")
+        classes = {c.__name__: c for c in _subclasses(LanguageModel)}
+        if meta["class"] not in classes:
+            raise ValueError(f"Model {directory} is of unknown class {meta['class']}")
+        with open(directory / "vocab.txt") as f:
+            vocab: Vocab = Integerizer(f.read().split("\n"))
+        kwargs = meta["hyperparameters"]
+        kwargs.update({name: directory / file for name, file in meta["files"].items()})
+        lm = classes[meta["class"]](vocab, **kwargs)
+        mmap_mode = "c" if mmap else None
+        lm.use_arrays({name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in meta["arrays"]})
+        return lm
+
+    def integerize_legacy(self) -> None:
+        """Upgrade a model that was pickled before word types were integerized,
+        when the vocab was a set of strings and the counts were keyed on tuples of strings."""
+        words = self.vocab
+        self.vocab = Integerizer([BOS, EOS, OOV] + sorted(words))
+
+        # An n-gram's event and context counts agree wherever both are nonzero,
+        # so we can store whichever one is nonzero (i.e., the larger one).
+        legacy = self.event_count | self.context_count   # type: ignore
+        by_order: Dict[int, List[Tuple[Ngram, int]]] = {}
+        for ngram, c in legacy.items():
+            ids = tuple(self.vocab.index(w) for w in ngram)
+            by_order.setdefault(len(ngram), []).append((ids, c))   # type: ignore
+        counts = NgramCounts(len(self.vocab))
+        for order, entries in by_order.items():
+            ngrams, c = zip(*entries)
+            counts.add(np.array(ngrams, dtype=np.int64).reshape(len(ngrams), order), np.array(c))
+        self.use_counts(counts)
+
+    def next_word_distribution(self, x: Wordtype, y: Wordtype) -> np.ndarray:
+        """The distribution p(z | xy) over all the word types z, as a vector
+        indexed by id.  (Its element for BOS, which is never an outcome, is 0.)"""
+        return self.next_word_distributions(np.array([x]), np.array([y]))[0]
+
+    def next_word_distributions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Vectorized version of `next_word_distribution`: a matrix whose row i
+        is the distribution p(z | xs[i] ys[i]).  Subclasses may override this
+        with a faster version; this default uses `log_prob_batch`."""
+        V = len(self.vocab)
+        zs = np.tile(np.arange(V), len(xs))
+        p = np.exp(self.log_prob_batch(np.repeat(xs, V), np.repeat(ys, V), zs)).reshape(len(xs), V)
+        p[:, BOS_ID] = 0
+        return p
+
+    def top_k(self, x: Wordtype, y: Wordtype, k: int) -> List[Tuple[Wordtype, float]]:
+        """The k most probable next words z after the context xy, with their
+        probabilities p(z | xy), most probable first (ties go to the lower id).
+        Only the candidates from `top_k_candidates` are scored."""
+        zs = self.top_k_candidates(x, y, k)
+        zs = zs[zs != BOS_ID]
+        p = np.exp(self.log_prob_batch(np.full(len(zs), x), np.full(len(zs), y), zs))
+        best = np.lexsort((zs, -p))[:k]
+        return [(int(z), float(pz)) for z, pz in zip(zs[best], p[best])]
+
+    def top_k_candidates(self, x: Wordtype, y: Wordtype, k: int) -> np.ndarray:
+        """Ids of word types that include the k most probable next words after
+        xy (in case of ties, the ones with the lowest ids).  By default, that's
+        the whole vocabulary; subclasses narrow it down using the observed
+        successors of the context, so that `top_k` takes time proportional
+        to their number rather than to the size of the vocabulary."""
+        return np.arange(len(self.vocab))
 
     def sample(self,max_length=20, start_symbol='BOS', end_symbol='EOS'):
     #     """ implementation od sampling method Q6
@@ -274,57 +774,123 @@ class LanguageModel:
         
     #     """
         self.gen_sen = ""
-        x , y = "BOS", "BOS"
-        #pdb.set_trace()
+        x , y = BOS_ID, BOS_ID
         self.new_sample((x,y), self.gen_sen, max_length)
    
     def new_sample(self, context, gen_sen, remaining_expansions):
-        remaining_expansions -= 1
-        probs = []
-        choice_opt = []
-        x,y = context
-        for z in self.vocab:
-            probs.append(self.prob(x,y,z))
-            choice_opt.append(z)
-        sample =  random.choices(choice_opt, weights=probs, k=1)[0]
-        if sample == "":
-            pass
-        else:
-            self.gen_sen = self.gen_sen + " " + sample
-            if len(gen_sen) > 0 and gen_sen[-1] == "EOS":
-                return 
-                #gen_sen = gen_sen + "(" + node.name + " "
-            elif remaining_expansions == 0 and gen_sen[-1] != "EOS":
-                    self.gen_sen += " ..."
-                    return
-            else:
-                x, y = y, z 
-        self.new_sample((x,y), self.gen_sen, remaining_expansions)
+        # Extend self.gen_sen one word at a time (see sampler.py to generate
+        # many sentences at once, much faster).
+        x, y = context
+        choice_opt = range(len(self.vocab))
+        while remaining_expansions > 0:
+            remaining_expansions -= 1
+            z = random.choices(choice_opt, weights=self.next_word_distribution(x, y), k=1)[0]
+            if z == EOS_ID:
+                return
+            self.gen_sen = self.gen_sen + " " + self.vocab[z]
+            x, y = y, z
+        self.gen_sen += " ..."
     
     def save(self, destination: Path) -> None:
-        import pickle
+        """Save the model as a directory (see `load_directory`)."""
         log.info(f"Saving model to {destination}")
-        with open(destination, mode="wb") as f:
-            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        destination = Path(destination)
+        if destination.is_file():
+            destination.unlink()   # a model saved in the old (pickle) format
+        destination.mkdir(parents=True, exist_ok=True)
+        with open(destination / "vocab.txt", "w") as f:
+            f.write("\n".join(self.vocab))
+        arrays = self.arrays()
+        for name, array in arrays.items():
+            np.save(destination / f"{name}.npy", array)
+        files = {name: str(path.relative_to(destination)) for name, path in self.save_extra(destination).items()}
+        meta = {"format_version": self.MODEL_FORMAT_VERSION,
+                "class": type(self).__name__,
+                "hyperparameters": self.hyperparameters(),
+                "files": files,
+                "arrays": sorted(arrays)}
+        with open(destination / "meta.json", "w") as f:   # last, so an incomplete model can't be loaded
+            json.dump(meta, f, indent=2)
         log.info(f"Saved model to {destination}")
 
-    def train(self, file: Path) -> None:
+    def train(self, corpus: Corpus, jobs: int = 1) -> None:
         """Create vocabulary and store n-gram counts.  In subclasses, we might
-        override this with a method that computes parameters instead of counts."""
-
-        log.info(f"Training from corpus {file}")
-
-        # Clear out any previous training.
-        self.event_count   = Counter()
-        self.context_count = Counter()
-
-        for trigram in read_trigrams(file, self.vocab):
-            self.count_trigram_events(trigram)
-            self.count_trigram_contexts(trigram)
-            self.show_progress()
-
-        sys.stderr.write("\n")  # done printing progress dots "...."
+        override this with a method that computes parameters instead of counts.
+        The corpus may be one or more files, directories, or glob patterns
+        (see `corpus_files`).  It is counted in chunks, by `jobs` processes
+        at once, and the counts of the chunks are merged."""
+
+        log.info(f"Training from corpus {corpus}")
+
+        # Replaces any previous training.
+        with profiling.timer("train: read and count"):
+            chunks = corpus_chunks(corpus)
+            count = functools.partial(count_chunk, order=self.order)
+            self.use_counts(NgramCounts.merged(map_chunks(count, chunks, self.vocab, jobs), len(self.vocab), self.order))
         log.info(f"Finished counting {self.event_count[()]} tokens")
+        self.finalize()
+
+    def update(self, corpus: Corpus, jobs: int = 1, new_words: Iterable[Word] = (),
+               promote_threshold: Optional[int] = None) -> None:
+        """Add the counts of more training data to this already trained model,
+        instead of retraining it on all the data from scratch.  The result is
+        the same as training on the old data and the new data together,
+        except that the vocab may grow first: it gets the new_words, and also
+        the OOV words that occur at least promote_threshold times in the new
+        data (if that's given).  The old occurrences of a new word type were
+        counted as OOV, and stay that way.
+
+        A model that prunes its counts (min_count > 1) can't be updated: it
+        no longer has the counts of the rare n-grams, which the new data might
+        push over the threshold, so it has to be retrained from scratch."""
+        if self.min_count > 1:
+            raise ValueError(f"Can't update a model that was pruned with min_count={self.min_count}, "
+                             f"since it has lost the counts of its rare n-grams; retrain it on all the data instead")
+        log.info(f"Updating model with corpus {corpus}")
+        added = [w for w in dict.fromkeys(new_words) if w not in self.vocab]
+        if promote_threshold is not None:
+            oov: Counter[Word] = Counter()
+            for chunk_oov in map_chunks(count_oov_chunk, corpus_chunks(corpus), self.vocab, jobs):
+                oov.update(chunk_oov)
+            promoted = sorted((w for w, c in oov.items() if c >= promote_threshold), key=lambda w: (-oov[w], w))
+            already = set(added)
+            added += [w for w in promoted if w not in already]
+        if added:
+            log.info(f"Adding {len(added)} word types to the vocab")
+            self.grow_vocab(added)
+
+        # The old counts go first, so that they're sorted together with the new ones
+        # only once there are about as many new ones (see `NgramCounts.merged`).
+        with profiling.timer("train: read and count"):
+            count = functools.partial(count_chunk, order=self.order)
+            chunk_counts = map_chunks(count, corpus_chunks(corpus), self.vocab, jobs)
+            self.use_counts(NgramCounts.merged(itertools.chain([self.counts], chunk_counts), len(self.vocab), self.order))
+        log.info(f"Finished counting; now have {self.event_count[()]} tokens")
+        self.finalize()   # rebuilds what the new counts made stale
+
+    def grow_vocab(self, words: Sequence[Word]) -> None:
+        """Add new word types to the vocab, after the old ones, which keep their ids."""
+        self.vocab = Integerizer(list(self.vocab) + list(words))   # a copy, in case the old one is shared
+        self.use_counts(self.counts.with_radix(len(self.vocab)))
+
+    def finalize(self) -> None:
+        """Prepare the trained model to answer queries quickly.  This indexes
+        the block of observed successors of each context in the counts (see
+        `NgramCounts.build_index`); subclasses may precompute more.  It's
+        called at the end of `train` and by `load`, and does nothing if
+        there is nothing new to do (e.g., when the index was saved with the model)."""
+        self.counts.build_index()
+
+    def prune(self) -> Dict[int, np.ndarray]:
+        """Drop the n-grams of order 3 and up that were counted fewer than
+        min_count times, to make the model smaller, and reindex the counts.
+        Returns which entries of the arrays of each order were kept (see
+        `NgramCounts.prune`).  The pruned counts are gone for good, so a pruned
+        model can't be updated or merged.  Subclasses that prune call this from `finalize`,
+        which is also where they make up for the pruned n-grams."""
+        kept = self.counts.prune(self.min_count, min_order=3) if self.min_count > 1 else {}
+        self.counts.build_index()
+        return kept
 
     def show_progress(self, freq: int = 5000) -> None:
         """Print a dot to stderr every 5000 calls (frequency can be changed)."""
@@ -333,14 +899,31 @@ class LanguageModel:
             sys.stderr.write(".")
 
 
+def _subclasses(cls: type) -> Iterable[type]:
+    """All the (direct or indirect) subclasses of cls."""
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+
 ##### SPECIFIC FAMILIES OF LANGUAGE MODELS
 
 class UniformLanguageModel(LanguageModel):
     def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
         return 1 / self.vocab_size
 
+    def log_prob_batch(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray) -> np.ndarray:
+        return np.full(len(zs), -math.log(self.vocab_size))
+
+    def next_word_distributions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        p = np.full((len(xs), len(self.vocab)), 1 / self.vocab_size)
+        p[:, BOS_ID] = 0
+        return p
+
 
 class AddLambdaLanguageModel(LanguageModel):
+    SORTED_LOOKUPS = True
+
     def __init__(self, vocab: Vocab, lambda_: float) -> None:
         super().__init__(vocab)
 
@@ -348,73 +931,464 @@ class AddLambdaLanguageModel(LanguageModel):
             raise ValueError("negative lambda argument of {lambda_}")
         self.lambda_ = lambda_
 
+    def hyperparameters(self) -> Dict[str, Any]:
+        return {"lambda_": self.lambda_}
+
     def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
-        assert self.event_count[x, y, z] <= self.context_count[x, y]
-        return ((self.event_count[x, y, z] + self.lambda_) / 
-                (self.context_count[x, y] + self.lambda_ * self.vocab_size))
+        # This is event_count[x, y, z] and context_count[x, y], but straight
+        # from the store, since this is the hot path of one-at-a-time scoring.
+        # (No trigram ends in BOS, but the bigram xy may end in EOS.)
+        counts, R, hashes = self.counts, self.counts.radix, self.counts.hashes
+        c_xyz = (hashes.get(3) or counts.hash_table(3)).get((x * R + y) * R + z, 0)
+        c_xy = (hashes.get(2) or counts.hash_table(2)).get(x * R + y, 0) if y != EOS_ID else 0
+        assert c_xyz <= c_xy
+        return ((c_xyz + self.lambda_) / 
+                (c_xy + self.lambda_ * (R - 1)))   # (R - 1 is the vocab size, without BOS)
 
         # Notice that summing the numerator over all values of typeZ
         # will give the denominator.  Therefore, summing up the quotient
         # over all values of typeZ will give 1, so sum_z p(z | ...) = 1
         # as is required for any probability function.
 
+    def log_prob_batch(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray) -> np.ndarray:
+        c_xyz = self.event_count.lookup(np.stack([xs, ys, zs], axis=1))
+        c_xy = self.context_count.lookup(np.stack([xs, ys], axis=1))
+        return np.log((c_xyz + self.lambda_) /
+                      (c_xy + self.lambda_ * self.vocab_size))
+
+    def next_word_distributions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # Every z gets the numerator lambda, plus c(xyz) for the observed successors z of xy.
+        contexts = np.stack([xs, ys], axis=1)
+        p = np.full((len(xs), len(self.vocab)), float(self.lambda_))
+        rows, zs, c_xyz = self.event_count.successors(contexts)
+        p[rows, zs] += c_xyz
+        p /= (self.context_count.lookup(contexts) + self.lambda_ * self.vocab_size)[:, np.newaxis]
+        p[:, BOS_ID] = 0
+        return p
+
+    def top_k_candidates(self, x: Wordtype, y: Wordtype, k: int) -> np.ndarray:
+        # The observed successors of xy, followed by the unobserved words,
+        # which are all equally probable, so the first k of them will do.
+        seen, _ = self.event_count.top_successors((x, y), k)
+        return np.union1d(seen, np.arange(min(len(self.vocab), k + len(seen) + 1)))
+
 
 class BackoffAddLambdaLanguageModel(AddLambdaLanguageModel):
-    def __init__(self, vocab: Vocab, lambda_: float) -> None:
+    """
+    Add-lambda smoothing that backs off to the (smoothed) estimates of the
+    lower orders rather than to the uniform distribution.  For a trigram model:
+
+        p(z)      = (c(z)   + lambda)            / (c()   + lambda V)
+        p(z | y)  = (c(yz)  + lambda V p(z))     / (c(y)  + lambda V)
+        p(z | xy) = (c(xyz) + lambda V p(z | y)) / (c(xy) + lambda V)
+
+    and a model of another `order` n conditions on the n-1 previous words,
+    backing off one word at a time in the same way.
+
+    (With lambda = 0, a word z that was never observed has p(z) = 0, so it
+    is scored as OOV instead, using OOV's counts throughout.)
+
+    Everything in these formulas that doesn't involve the whole n-gram is
+    precomputed by `finalize`: p(z) for every z, and the reciprocals of the
+    denominators for every context.  So scoring an n-gram is just the lookups
+    of the counts of its suffixes, and a few multiply-adds.
+
+    If min_count > 1, `finalize` prunes the n-grams of order 3 and up that
+    were seen fewer than min_count times, and the model is then as if they
+    had never been counted: their contexts' denominators shrink accordingly.
+    """
+    z_or_oov: np.ndarray               # z, or OOV where p(z) is 0, dense
+    unigram: np.ndarray                # p(z), dense
+    inverse_denominator1: np.ndarray   # 1 / (c(y) + lambda V), dense
+    # and for each longer context length j, inverse_denominator{j}: 1 / (c(context) + lambda V),
+    # parallel to the contexts of counts.index[j + 1], and then for all the other contexts (whose count is 0)
+
+    def __init__(self, vocab: Vocab, lambda_: float, order: int = 3, min_count: int = 1) -> None:
         super().__init__(vocab, lambda_)
+        if order < 1:
+            raise ValueError(f"order must be at least 1, not {order}")
+        if min_count < 1:
+            raise ValueError(f"min_count must be at least 1, not {min_count}")
+        self.order = order
+        self.min_count = min_count
+        self.use_counts(NgramCounts(len(vocab), order))
+
+    def hyperparameters(self) -> Dict[str, Any]:
+        return {**super().hyperparameters(), "order": self.order, "min_count": self.min_count}
+
+    @property
+    def PRECOMPUTED(self) -> List[str]:   # type: ignore
+        return ["z_or_oov", "unigram"] + [f"inverse_denominator{j}" for j in range(1, self.order)]
+
+    def inverse_denominators(self, contexts: np.ndarray) -> np.ndarray:
+        """1 / (c(context) + lambda V) for each row of a 2-D array of contexts."""
+        j = contexts.shape[1]
+        inverse_denominator = getattr(self, f"inverse_denominator{j}")
+        if j == 1:
+            return inverse_denominator[contexts[:, 0]]
+        return find_values(self.counts.index[j + 1][0], inverse_denominator,   # type: ignore
+                           self.counts.pack(contexts), inverse_denominator.item(-1))
+
+    def finalize(self) -> None:
+        super().finalize()
+        if self.is_precomputed():
+            return
+        self.prune()
+        counts, V = self.counts, len(self.vocab)
+        lambda_V = self.lambda_ * self.vocab_size
+        with np.errstate(invalid="ignore", divide="ignore"):   # (possible when lambda is 0)
+            p_unigrams = (self.event_count.lookup(np.arange(V)[:, np.newaxis]) + self.lambda_) / (self.context_count[()] + lambda_V)
+            unseen = p_unigrams == 0
+            p_unigrams[unseen] = self.event_count[(OOV_ID,)] / self.context_count[()]
+            self.z_or_oov = np.where(unseen, OOV_ID, np.arange(V))
+            self.unigram = p_unigrams
+            if self.order > 1:
+                self.inverse_denominator1 = 1 / (self.context_count.lookup(np.arange(V)[:, np.newaxis]) + lambda_V)
+            for j in range(2, self.order):
+                # c(context) is the total count of the events that extend it,
+                # which are the n-grams of order j+1 that don't end in BOS
+                # (and are still there after pruning).
+                keys, offsets = counts.keys[j + 1], counts.index[j + 1][1]
+                c_events = np.where(keys % counts.radix != BOS_ID, counts.counts[j + 1], 0)   # type: ignore
+                c_contexts = np.add.reduceat(c_events, offsets[:-1]) if len(c_events) else np.zeros(0)
+                setattr(self, f"inverse_denominator{j}", 1 / (np.r_[c_contexts, 0] + lambda_V))
 
     def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
-        # TODO: Reimplement me so that I do backoff
-        assert self.event_count[x, y, z] <= self.context_count[x, y]
-        #pdb.set_trace()
-        # p_unigrams = self.event_count[(z,)]/self.context_count[()]
-        p_unigrams = (self.event_count[(z,)]+self.lambda_)/(self.context_count[()]+self.lambda_*self.vocab_size)
-        if p_unigrams ==0:
-            p_unigrams = self.event_count[('OOV',)]/self.context_count[()]
-            p_bigrams = (self.event_count[(y,'OOV')] + self.lambda_*self.vocab_size*p_unigrams)/(self.context_count[(y,)]+self.lambda_*self.vocab_size)
-            
-            trigram = ((self.event_count[x, y, 'OOV'] + self.lambda_*self.vocab_size*p_bigrams) /
-                    (self.context_count[x, y] + self.lambda_ * self.vocab_size))
-        else:
-            p_bigrams = (self.event_count[(y,z)] + self.lambda_*self.vocab_size*p_unigrams)/(self.context_count[(y,)]+self.lambda_*self.vocab_size)
-            
-            trigram = ((self.event_count[x, y, z] + self.lambda_*self.vocab_size*p_bigrams) /
-                    (self.context_count[x, y] + self.lambda_ * self.vocab_size))
-       # if trigram <= 0.0:
-        #     pdb.set_trace()
-        return trigram
-        #return super().prob(x, y, z)
+        if self.order != 3:
+            return self.ngram_probs(np.column_stack([self.trigram_histories(np.array([x]), np.array([y])), [z]])).item(0)
+        # The counts come straight from the store, as in AddLambdaLanguageModel.prob.
+        # If xy was never a context, no trigram extends it.
+        counts, R = self.counts, self.counts.radix
+        lambda_V = self.lambda_ * (R - 1)   # (R - 1 is the vocab size, without BOS)
+        w = self.z_or_oov.item(z)
+        c_yw = counts.count(2, y * R + w) if w != BOS_ID else 0
+        p_bigram = (c_yw + lambda_V * self.unigram.item(z)) * self.inverse_denominator1.item(y)
+        i = counts.find_context(3, x * R + y)
+        if i < 0:
+            return (0 + lambda_V * p_bigram) * self.inverse_denominator2.item(-1)
+        return (counts.count(3, (x * R + y) * R + w) + lambda_V * p_bigram) * self.inverse_denominator2.item(i)
         # Don't forget the difference between the Wordtype z and the
         # 1-element tuple (z,). If you're looking up counts,
         # these will have very different counts!
 
+    def log_prob_batch(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray) -> np.ndarray:
+        return np.log(self.ngram_probs(np.column_stack([self.trigram_histories(xs, ys), zs])))
+
+    def log_prob_ngrams(self, ngrams: np.ndarray) -> np.ndarray:
+        return np.log(self.ngram_probs(ngrams))
+
+    def ngram_probs(self, ngrams: np.ndarray) -> np.ndarray:
+        """p(w | h) for each row h w of a 2-D array of n-grams, like `prob`
+        but for every n-gram at once, and for any order.  Only the last
+        `order` columns are used."""
+        if ngrams.shape[1] < self.order:
+            raise ValueError(f"A model of order {self.order} can't score {ngrams.shape[1]}-grams")
+        lambda_V = self.lambda_ * self.vocab_size
+        zs = ngrams[:, -1]
+        ws = self.z_or_oov[zs]
+        p = self.unigram[zs]
+        for j in range(1, self.order):   # back off from the contexts of length j
+            contexts = ngrams[:, -1 - j:-1]
+            p = (self.event_count.lookup(np.column_stack([contexts, ws])) + lambda_V * p) * self.inverse_denominators(contexts)
+        return p
+
+    def backoff_levels(self, ngrams: np.ndarray) -> np.ndarray:
+        """For each n-gram, the length of the longest of its suffixes (up to
+        the model's order) that was observed in training (0 if not even its
+        last word was).  This is how far `prob` has to back off before it
+        reaches a nonzero count (for profiling)."""
+        levels = (self.event_count.lookup(ngrams[:, -1:]) > 0).astype(np.int64)
+        for k in range(2, self.order + 1):
+            levels[self.event_count.lookup(ngrams[:, -k:]) > 0] = k
+        return levels
+
+    def next_word_distributions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # Same computation as `ngram_probs`, for all z at once.  The counts
+        # of the n-grams that end in z are 0 except for the observed successors
+        # of their contexts, so we start from dense matrices of zeros and fill those in.
+        V = len(self.vocab)
+        lambda_V = self.lambda_ * self.vocab_size
+        histories = self.trigram_histories(xs, ys)
+        p = self.unigram
+        for j in range(1, self.order):
+            contexts = histories[:, histories.shape[1] - j:]
+            c = np.zeros((len(xs), V))
+            rows, zs, counts = self.event_count.successors(contexts)
+            c[rows, zs] = counts
+            p = (c[:, self.z_or_oov] + lambda_V * p) * self.inverse_denominators(contexts)[:, np.newaxis]
+        if p.ndim == 1:   # a unigram model
+            p = np.tile(p, (len(xs), 1))
+        p[:, BOS_ID] = 0
+        return p
+
+    def top_k_candidates(self, x: Wordtype, y: Wordtype, k: int) -> np.ndarray:
+        if self.lambda_ == 0:
+            # Unobserved words then back off to OOV's probability, unlike
+            # any other word's, so there is no shortcut.
+            return super().top_k_candidates(x, y, k)
+        # A word that was observed after none of the contexts gets a probability
+        # proportional to its unigram probability.  So the top k are among
+        # the observed successors of the contexts, and the most frequent
+        # unigrams (enough of them to make up for any that are also successors,
+        # or BOS).  Unigrams with equal counts are ordered by id, as ties should be.
+        history = self.trigram_histories(np.array([x]), np.array([y]))
+        successors = [self.event_count.successors(history[:, j:])[1] for j in range(history.shape[1])]
+        if self.counts.by_count is None:
+            self.counts.build_index()
+        frequent = self.counts.by_count[:k + sum(map(len, successors)) + 1]   # type: ignore
+        candidates = np.sort(np.concatenate(successors + [frequent]))
+        return candidates[np.diff(candidates, prepend=-1) != 0]
+
+
+class KneserNeyLanguageModel(LanguageModel):
+    """
+    Interpolated modified Kneser-Ney smoothing (Chen and Goodman 1999).
+    Each order discounts its counts by D1, D2 or D3+ (for counts of 1, 2 and
+    3 or more, estimated from the counts of counts), and gives the discounted
+    mass to the next lower order, down to a uniform distribution.  For a
+    trigram model:
+
+        p(z | xy) = (c(xyz) - D(c(xyz))) / c(xy)  +  gamma(xy) p(z | y)
+
+    and a model of another `order` works the same way over its n-grams.
+    The lower orders count how many different words precede an n-gram
+    (its continuation count), rather than how often it occurs, except for
+    n-grams that start with BOS, which can't be preceded by anything else.
+
+    `finalize` precomputes the discounted first term of every observed n-gram
+    of order 2 and up, in arrays parallel to the count store's keys, as well
+    as gamma of each context and the whole unigram distribution.  So `prob`
+    is just a few binary searches and multiply-adds.
+
+    If min_count > 1, `finalize` then prunes the n-grams of order 3 and up
+    that were seen fewer than min_count times, and the first terms of the
+    pruned n-grams go to their contexts' gammas.  So the pruned n-grams get
+    their lower-order estimates instead, and the distributions still sum to 1.
+    """
+    unigram: np.ndarray   # p(z), dense
+    gamma2: np.ndarray    # gamma(y), dense
+    first2: np.ndarray    # first term of p(z | y), parallel to counts.keys[2]
+    # and for each order k > 2, gamma{k}: gamma(context), parallel to the contexts of counts.index[k],
+    # and first{k}: the first term of p(w | context), parallel to counts.keys[k]
+    by_prob: np.ndarray   # the ids by decreasing p(z), for `top_k_candidates`
+    SORTED_LOOKUPS = True
+
+    def __init__(self, vocab: Vocab, order: int = 3, min_count: int = 1) -> None:
+        if order < 1:
+            raise ValueError(f"order must be at least 1, not {order}")
+        if min_count < 1:
+            raise ValueError(f"min_count must be at least 1, not {min_count}")
+        super().__init__(vocab, order)
+        self.min_count = min_count
+
+    def hyperparameters(self) -> Dict[str, Any]:
+        return {"order": self.order, "min_count": self.min_count}
+
+    @property
+    def PRECOMPUTED(self) -> List[str]:   # type: ignore
+        return (["unigram", "by_prob"] +
+                [f"{name}{k}" for k in range(2, self.order + 1) for name in ["gamma", "first"]])
+
+    def gammas(self, contexts: np.ndarray) -> np.ndarray:
+        """gamma(context) for each row of a 2-D array of contexts."""
+        k = contexts.shape[1] + 1
+        if k == 2:
+            return self.gamma2[contexts[:, 0]]
+        return find_values(self.counts.index[k][0], getattr(self, f"gamma{k}"),   # type: ignore
+                           self.counts.pack(contexts), 1.0)
+
+    def finalize(self) -> None:
+        super().finalize()
+        if self.is_precomputed():
+            return
+        counts, R, V = self.counts, self.counts.radix, len(self.vocab)
+
+        # Work down from the highest order, since each order's continuation
+        # counts come from the n-grams of the order above.
+        above: Optional[np.ndarray] = None   # the keys of the events of the order above
+        for k in range(self.order, 1, -1):
+            keys = counts.keys[k]
+            contexts, offsets = counts.index[k]
+            events = keys % R != BOS_ID   # type: ignore  # (the others are only contexts, like BOS BOS)
+            if above is None:
+                # The highest order: the counts themselves.
+                c = np.where(events, counts.counts[k], 0)
+            else:
+                # The number of different words w that precede each n-gram,
+                # which are the events w+n-gram of the order above (a block of
+                # those keys for each w, so we count them all with a sort).
+                # But an n-gram that starts with BOS keeps its count.
+                suffixes, preceding = np.unique(above % R ** k, return_counts=True)
+                c = np.zeros(len(keys), dtype=np.int64)   # type: ignore
+                c[keys.searchsorted(suffixes)] = preceding   # type: ignore
+                starts_sentence = events & (keys // R ** (k - 1) == BOS_ID)   # type: ignore
+                c[starts_sentence] = counts.counts[k][starts_sentence]
+            discount = kn_discounts(c[events])[np.minimum(c, 3)]
+            discount[~events] = 0
+            if k == 2:
+                ys = keys // R   # type: ignore
+                total = np.bincount(ys, weights=c, minlength=V)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    self.first2 = np.where(events, (c - discount) / total[ys], 0)
+                    self.gamma2 = np.where(total > 0, np.bincount(ys, weights=discount, minlength=V) / total, 1)
+            else:
+                total = np.add.reduceat(c, offsets[:-1]) if len(c) else np.zeros(0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    setattr(self, f"first{k}", np.where(events, (c - discount) / np.repeat(total, np.diff(offsets)), 0))
+                    setattr(self, f"gamma{k}", (np.add.reduceat(discount, offsets[:-1]) if len(c) else np.zeros(0)) / total)
+            above = keys[events]   # type: ignore
+
+        # Unigrams: the number of different y that precede z (or for a
+        # unigram model, the counts themselves), interpolated with the
+        # uniform distribution over all the possible events.
+        if above is None:
+            c1 = self.event_count.lookup(np.arange(V)[:, np.newaxis])
+        else:
+            c1 = np.bincount(above % R, minlength=V)
+        discount1 = kn_discounts(c1[c1 > 0])[np.minimum(c1, 3)]
+        total1 = c1.sum()
+        if total1 > 0:
+            self.unigram = (c1 - discount1) / total1 + discount1.sum() / total1 / self.vocab_size
+        else:   # nothing was observed
+            self.unigram = np.full(V, 1 / self.vocab_size)
+        self.unigram[BOS_ID] = 0
+        self.by_prob = np.lexsort((np.arange(V), -self.unigram))
+
+        # Prune, moving the first terms of the pruned n-grams into the gammas
+        # of their contexts, and dropping the gammas of contexts that have no
+        # n-grams left (whose gammas are then 1, as they should be).
+        old_index = {k: counts.index[k] for k in range(3, self.order + 1)}
+        for k, keep in self.prune().items():
+            first, gamma = getattr(self, f"first{k}"), getattr(self, f"gamma{k}")
+            contexts, offsets = old_index[k]
+            context_of = np.repeat(np.arange(len(contexts)), np.diff(offsets))   # type: ignore
+            gamma = gamma + np.bincount(context_of[~keep], weights=first[~keep], minlength=len(gamma))
+            setattr(self, f"first{k}", first[keep])
+            setattr(self, f"gamma{k}", gamma[np.bincount(context_of[keep], minlength=len(gamma)) > 0])
+
+    def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
+        if self.order != 3:
+            return self.ngram_probs(np.column_stack([self.trigram_histories(np.array([x]), np.array([y])), [z]])).item(0)
+        R = self.counts.radix
+        p = self.unigram.item(z)   # type: ignore
+        p = self.gamma2.item(y) * p + find_value(self.counts.keys[2], self.first2, y * R + z, 0.0)   # type: ignore
+        gamma3 = find_value(self.counts.index[3][0], self.gamma3, x * R + y, 1.0)   # type: ignore
+        return gamma3 * p + find_value(self.counts.keys[3], self.first3, (x * R + y) * R + z, 0.0)   # type: ignore
+
+    def log_prob_batch(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray) -> np.ndarray:
+        return np.log(self.ngram_probs(np.column_stack([self.trigram_histories(xs, ys), zs])))
+
+    def log_prob_ngrams(self, ngrams: np.ndarray) -> np.ndarray:
+        return np.log(self.ngram_probs(ngrams))
+
+    def ngram_probs(self, ngrams: np.ndarray) -> np.ndarray:
+        """p(w | h) for each row h w of a 2-D array of n-grams, like `prob`
+        but for every n-gram at once, and for any order.  Only the last
+        `order` columns are used."""
+        if ngrams.shape[1] < self.order:
+            raise ValueError(f"A model of order {self.order} can't score {ngrams.shape[1]}-grams")
+        p = self.unigram[ngrams[:, -1]]
+        for k in range(2, self.order + 1):
+            first = find_values(self.counts.keys[k], getattr(self, f"first{k}"),   # type: ignore
+                                self.counts.pack(ngrams[:, -k:]), 0.0)
+            p = self.gammas(ngrams[:, -k:-1]) * p + first
+        return p
+
+    def next_word_distributions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # Same computation as `ngram_probs`, for all z at once.  The first
+        # terms are 0 except for the observed successors of the contexts.
+        R = self.counts.radix
+        histories = self.trigram_histories(xs, ys)
+        p = self.unigram
+        for k in range(2, self.order + 1):
+            contexts = histories[:, histories.shape[1] - (k - 1):]
+            p = self.gammas(contexts)[:, np.newaxis] * p
+            rows, positions = self.counts.positions(contexts)
+            p[rows, self.counts.keys[k][positions] % R] += getattr(self, f"first{k}")[positions]   # type: ignore
+        if p.ndim == 1:   # a unigram model
+            p = np.tile(p, (len(xs), 1))
+        return p
+
+    def top_k_candidates(self, x: Wordtype, y: Wordtype, k: int) -> np.ndarray:
+        # A word that was observed after none of the contexts gets a probability
+        # proportional to its unigram probability (as in the backoff model).
+        history = self.trigram_histories(np.array([x]), np.array([y]))
+        successors = [self.event_count.successors(history[:, j:])[1] for j in range(history.shape[1])]
+        likely = self.by_prob[:k + sum(map(len, successors)) + 1]   # type: ignore
+        candidates = np.sort(np.concatenate(successors + [likely]))
+        return candidates[np.diff(candidates, prepend=-1) != 0]
+
+
+def kn_discounts(counts: np.ndarray) -> np.ndarray:
+    """The discounts [0, D1, D2, D3+] of modified Kneser-Ney for counts of 0,
+    1, 2 and 3 or more, estimated from how many of `counts` are 1, 2, 3 and 4
+    (Chen and Goodman 1999).  Where such an estimate is undefined or not in
+    (0, k] for count k, which can happen for small or unusual corpora, we fall
+    back to the single discount n1/(n1 + 2 n2) of absolute discounting.
+
+    >>> kn_discounts(np.array([1] * 40 + [2] * 15 + [3] * 8 + [4] * 5))
+    array([0.        , 0.57142857, 1.08571429, 1.57142857])
+    >>> kn_discounts(np.array([1] * 40 + [2] * 15 + [3] * 30 + [4] * 5))
+    array([0.        , 0.57142857, 0.57142857, 2.61904762])
+    """
+    n1, n2, n3, n4 = (np.count_nonzero(counts == k) for k in range(1, 5))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y = n1 / (n1 + 2 * n2)
+        discounts = np.array([0, 1 - 2 * y * n2 / n1, 2 - 3 * y * n3 / n2, 3 - 4 * y * n4 / n3])
+    fallback = y if 0 < y <= 1 else 0.5
+    k = np.arange(4)
+    return np.where((discounts > 0) & (discounts <= k), discounts, np.where(k > 0, fallback, 0))
+
+
+def find_value(keys: np.ndarray, values: np.ndarray, key: int, default: float) -> float:
+    """The value that goes with a key in a sorted array of keys, or default if it isn't there."""
+    i = int(keys.searchsorted(key))
+    return values.item(i) if i < len(keys) and keys.item(i) == key else default
+
+
+def find_values(keys: np.ndarray, values: np.ndarray, query: np.ndarray, default: float) -> np.ndarray:
+    """Vectorized version of `find_value`, for an array of keys to look up."""
+    if len(keys) == 0:
+        return np.full(len(query), default)
+    i = np.minimum(keys.searchsorted(query), len(keys) - 1)
+    return np.where(keys[i] == query, values[i], default)
+
 
 class EmbeddingLogLinearLanguageModel(LanguageModel, nn.Module):
     # Note the use of multiple inheritance: we are both a LanguageModel and a torch.nn.Module.
     
-    def __init__(self, vocab: Vocab, lexicon_file: Path, l2: float) -> None:
+    def __init__(self, vocab: Vocab, lexicon_file: Path, l2: float,
+                 precompute: bool = False, cache_size: int = 2 ** 16,
+                 epochs: int = 10, batch_size: int = 1, shuffle: bool = False,
+                 closed_form: bool = False) -> None:
         super().__init__(vocab)
         if l2 < 0:
             log.error(f"l2 regularization strength value was {l2}")
             raise ValueError("You must include a non-negative regularization value")
+        if epochs < 1 or batch_size < 1:
+            raise ValueError(f"Invalid training schedule: {epochs} epochs of batch size {batch_size}")
         self.l2: float = l2
-        self.Z_den = None
+
+        # Hyperparameters of SGD training (see `train`).
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        # Whether to compute the gradient in closed form rather than by backprop.
+        self.closed_form = closed_form
+
+        # The normalization constant Z depends only on the context xy, so
+        # once training is over we can remember it for recently seen contexts.
+        self.normalizers: LRUCache[float] = LRUCache(cache_size)
+        # Optionally, also precompute the scores of all trigrams (see `projections`).
+        self.precompute = precompute
+        self._projections: Optional[Tuple[torch.Tensor, torch.Tensor]] = None
         
         # TODO: READ THE LEXICON OF WORD VECTORS AND STORE IT IN A USEFUL FORMAT.
         self.lexicon = Lexicon.from_file(lexicon_file)
         
         self.dim =  len(self.lexicon.embeddings[1]) #99999999999  # TODO: SET THIS TO THE DIMENSIONALITY OF THE VECTORS
-        self.vocab_emb = torch.zeros((len(self.vocab),self.dim),dtype=torch.float32)
-        count = 0
-        for word in self.vocab:
-            if word in self.lexicon.word_to_int.keys():
-                #pdb.set_trace()
-                self.vocab_emb[count,:] = self.lexicon.embeddings[self.lexicon.word_to_int[word]]
-            else:
-            
-                self.vocab_emb[count,:] = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-            count +=1
-        #self.vocab_emb = torch.tensor(vocab_list, dtype=torch.float64)
+        self.vocab_rows = self.lexicon_rows()
+        self.vocab_emb = self.embed_vocab()
             
         # We wrap the following matrices in nn.Parameter objects.
         # This lets PyTorch know that these are parameters of the model
@@ -427,69 +1401,185 @@ class EmbeddingLogLinearLanguageModel(LanguageModel, nn.Module):
         self.X = nn.Parameter(torch.zeros((self.dim, self.dim),dtype=torch.float32), requires_grad=True)
         self.Y = nn.Parameter(torch.zeros((self.dim, self.dim),dtype=torch.float32), requires_grad=True)
 
+    def embed_vocab(self) -> torch.Tensor:
+        """Matrix whose row i is the embedding of the word type with id i."""
+        return self.lexicon.embeddings[self.vocab_rows].float()   # one gather, not a row at a time
+
+    def lexicon_rows(self) -> torch.Tensor:
+        """Array whose element i is the row of the lexicon that holds the
+        embedding of the word type with id i.  OOV and all other words that
+        are missing from the lexicon share the OOL embedding."""
+        word_to_int = self.lexicon.word_to_int
+        ool = word_to_int[OOL]
+        rows = [ool if word == OOV else word_to_int.get(word, ool) for word in self.vocab]
+        return torch.tensor(rows, dtype=torch.long)
+
+    def integerize_legacy(self) -> None:
+        super().integerize_legacy()
+        # The rows were in the old set's arbitrary order.
+        self.vocab_rows = self.lexicon_rows()
+        self.vocab_emb = self.embed_vocab()
+
+    def embedding(self, w: Wordtype) -> torch.Tensor:
+        """The lexicon's embedding of the word type with id w (see `lexicon_rows`)."""
+        return self.lexicon.embeddings[self.vocab_rows[w]]
+
+    @torch.no_grad()
     def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
         # This returns an ordinary float probability, using the
         # .item() method that extracts a number out of a Tensor.
-        #pdb.set_trace()
-        
-        
-        if (z =="OOV" or z not in self.lexicon.word_to_int.keys()):
-            z = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-        else:
-            z = self.lexicon.embeddings[self.lexicon.word_to_int[z]] 
-        
-
-    
-        if (y=="OOV" or y not in self.lexicon.word_to_int.keys()):
-            y = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-        else:
-            y = self.lexicon.embeddings[self.lexicon.word_to_int[y]] 
-        
-     
-       
-        if (x=="OOV" or x not in self.lexicon.word_to_int.keys()):
-            x = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-        else:
-            x = self.lexicon.embeddings[self.lexicon.word_to_int[x]] 
-        
         p = self.log_prob(x, y, z)
-       # assert isinstance(p, float)  # checks that we'll adhere to the return type annotation, which is inherited from superclass
-        return torch.exp(p) # please change this to p when training the model
+        return torch.exp(p).item()
 
     def log_prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> torch.Tensor:
         """Return log p(z | xy) according to this language model."""
-        # TODO: IMPLEMENT ME!
-        # Don't forget that you can create additional methods
-        # that you think are useful, if you'd like.
-        # It's cleaner than making this function massive.
-        #
-        # Be sure to use vectorization over the vocabulary to
-        # compute the normalization constant Z, or this method
-        # will be very slow.
-        #
-        # The operator `@` is a nice way to write matrix multiplication:
-        # you can write J @ K as shorthand for torch.mul(J, K).
-        # J @ K looks more like the usual math notation.
-        #pdb.set_trace()
-        x = x.double()
-        y = y.double()
-        z = x.double()
-        Xmat = torch.matmul(x,self.X.double())
-        Ymat =  torch.matmul(y,self.Y.double())
-        # Z_den = torch.sum(torch.exp(torch.matmul(Xmat,torch.transpose(self.vocab_emb,0,1).double())
-        #                      + torch.matmul(Ymat,torch.transpose(self.vocab_emb,0,1).double())))
-        #if self.Z_den == None:
-        Z_den = torch.logsumexp(torch.matmul(Xmat,torch.transpose(self.vocab_emb,0,1).double())
-                                + torch.matmul(Ymat,torch.transpose(self.vocab_emb,0,1).double()),0)
-        #else:
-        #   Z_den = self.Z_den
-        p_num = torch.exp(torch.matmul(Xmat,z) + torch.matmul(Ymat,z))
-        p = torch.log(p_num) - Z_den
-        #self.Z_den = Z_den
-        
-        return p
-
-    def train(self, file: Path):    # type: ignore
+        if not torch.is_grad_enabled():
+            # We're not training, so the parameters are fixed and we can use the caches.
+            if self.precompute:
+                x_scores, y_scores = self.projections()
+                score = x_scores[x, z] + y_scores[y, z]
+            else:
+                score = self.trigram_scores(torch.tensor([x]), torch.tensor([y]), torch.tensor([z]))[0]
+            return score - self.normalizer(x, y)
+
+        # During training, compute the score and normalizer from the parameters,
+        # in a way that lets backpropagation find their gradients.
+        xs, ys, zs = torch.tensor([x]), torch.tensor([y]), torch.tensor([z])
+        return (self.trigram_scores(xs, ys, zs) - self.log_normalizers(xs, ys))[0]
+
+    @torch.no_grad()
+    def log_prob_batch(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+        # Same computation as `log_prob`, on chunk_size trigrams at a time
+        # (which bounds the size of the chunk_size x |V| matrix of scores
+        # that we need for the normalizers that aren't cached yet).
+        log_probs = np.empty(len(zs))
+        for start in range(0, len(zs), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            x, y, z = (torch.from_numpy(ids[chunk]) for ids in (xs, ys, zs))
+            log_probs[chunk] = (self.trigram_scores(x, y, z) - self.normalizer_batch(x, y)).numpy()
+        return log_probs
+
+    @torch.no_grad()
+    def next_word_distributions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # One matrix product gives the scores of all z, and softmax normalizes them.
+        xs, ys = torch.from_numpy(xs), torch.from_numpy(ys)
+        if self.precompute:
+            x_scores, y_scores = self.projections()
+            scores = x_scores[xs] + y_scores[ys]
+        else:
+            emb = self.vocab_emb
+            XYmat = torch.matmul(emb[xs].double(),self.X.double()) + torch.matmul(emb[ys].double(),self.Y.double())
+            scores = torch.matmul(XYmat,torch.transpose(emb,0,1).double())
+        p = torch.zeros_like(scores)
+        p[:, 1:] = torch.softmax(scores[:, 1:], 1)   # all the outcomes, i.e., all but BOS (id 0)
+        return p.numpy()
+
+    def trigram_scores(self, xs: torch.Tensor, ys: torch.Tensor, zs: torch.Tensor) -> torch.Tensor:
+        """The unnormalized log-probabilities x'Xz + y'Yz of a batch of trigrams,
+        where x, y, z are the embeddings of the ids xs[i], ys[i], zs[i]."""
+        if self.precompute and not torch.is_grad_enabled():
+            x_scores, y_scores = self.projections()
+            return x_scores[xs, zs] + y_scores[ys, zs]   # two gathers and an add
+        emb = self.vocab_emb
+        # Since x'Xz + y'Yz = (x'X + y'Y)z, we only need one product with z.
+        XYmat = torch.matmul(emb[xs].double(),self.X.double()) + torch.matmul(emb[ys].double(),self.Y.double())
+        return (XYmat * emb[zs].double()).sum(1)
+
+    def log_normalizers(self, xs: torch.Tensor, ys: torch.Tensor) -> torch.Tensor:
+        """log Z(xy) for a batch of contexts, computed from scratch."""
+        if self.precompute and not torch.is_grad_enabled():
+            x_scores, y_scores = self.projections()
+            scores = x_scores[xs] + y_scores[ys]
+        else:
+            emb = self.vocab_emb
+            XYmat = torch.matmul(emb[xs].double(),self.X.double()) + torch.matmul(emb[ys].double(),self.Y.double())
+            scores = torch.matmul(XYmat,torch.transpose(emb,0,1).double())
+        # Z sums over all possible outcomes, which are all the word types except BOS (id 0).
+        return torch.logsumexp(scores[:, 1:], 1)
+
+    def normalizer(self, x: Wordtype, y: Wordtype) -> float:
+        """log Z(xy), taken from the cache if possible.  (Only use this when
+        the parameters aren't changing, i.e., not during training.)"""
+        context = x * len(self.vocab) + y
+        Z = self.normalizers.get(context)
+        if Z is None:
+            Z = self.normalizers[context] = self.log_normalizers(torch.tensor([x]), torch.tensor([y])).item()
+        return Z
+
+    def normalizer_batch(self, xs: torch.Tensor, ys: torch.Tensor) -> torch.Tensor:
+        """log Z(xs[i] ys[i]) for a batch of contexts, like `normalizer`.  We only
+        compute the normalizers of the distinct contexts that aren't cached."""
+        contexts, inverse = torch.unique(xs * len(self.vocab) + ys, return_inverse=True)
+        Z = torch.empty(len(contexts), dtype=torch.float64)
+        missing = []
+        for i, context in enumerate(contexts.tolist()):
+            cached = self.normalizers.get(context)
+            if cached is None:
+                missing.append(i)
+            else:
+                Z[i] = cached
+        if missing:
+            new = contexts[missing]
+            Z[missing] = self.log_normalizers(new // len(self.vocab), new % len(self.vocab))
+            for context, value in zip(new.tolist(), Z[missing].tolist()):
+                self.normalizers[context] = value
+        return Z[inverse]
+
+    def projections(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """The |V| x |V| matrices (E X E') and (E Y E'), where row i of E is
+        the embedding of id i.  Their [x,z] and [y,z] entries are the two
+        terms of the score of trigram xyz.  They are computed once, on first
+        use after training, and only if `self.precompute` is set, since they
+        take O(|V|^2) memory."""
+        if self._projections is None:
+            with torch.no_grad():
+                emb = self.vocab_emb.double()
+                outcomes = torch.transpose(emb,0,1)
+                self._projections = (torch.matmul(torch.matmul(emb,self.X.double()),outcomes),
+                                     torch.matmul(torch.matmul(emb,self.Y.double()),outcomes))
+            log.info(f"Precomputed {2 * len(self.vocab) ** 2} trigram scores")
+        return self._projections
+
+    def hyperparameters(self) -> Dict[str, Any]:
+        return {"l2": self.l2, "precompute": self.precompute, "cache_size": self.normalizers.maxsize,
+                "epochs": self.epochs, "batch_size": self.batch_size, "shuffle": self.shuffle,
+                "closed_form": self.closed_form}
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {**super().arrays(), "X": self.X.detach().numpy(), "Y": self.Y.detach().numpy(),
+                "vocab_emb": self.vocab_emb.numpy()}
+
+    def use_arrays(self, arrays: Dict[str, np.ndarray]) -> None:
+        super().use_arrays(arrays)
+        with torch.no_grad():
+            self.X.copy_(torch.from_numpy(arrays["X"]))
+            self.Y.copy_(torch.from_numpy(arrays["Y"]))
+        if "vocab_emb" in arrays:   # use it as is, since it may be memory-mapped
+            self.vocab_emb = torch.from_numpy(arrays["vocab_emb"])
+        self.clear_caches()
+
+    def save_extra(self, directory: Path) -> Dict[str, Path]:
+        # Save just the part of the lexicon that our vocab uses, in its binary format.
+        rows = torch.unique(self.vocab_rows).tolist()
+        words = [self.lexicon.int_to_word[row] for row in rows]
+        lexicon = Lexicon(dict(enumerate(words)), {word: i for i, word in enumerate(words)},
+                          self.lexicon.embeddings[rows])
+        lexicon.save_binary(directory / "lexicon.bin")
+        return {"lexicon_file": directory / "lexicon.bin"}
+
+    def clear_caches(self) -> None:
+        """Forget everything that was computed from the current parameters."""
+        self.normalizers.clear()
+        self._projections = None
+
+    def __getstate__(self) -> dict:
+        # Don't pickle the caches; they can be large and are easy to recompute.
+        state = self.__dict__.copy()
+        state["normalizers"] = LRUCache(self.normalizers.maxsize)
+        state["_projections"] = None
+        return state
+
+    def train(self, corpus: Corpus, jobs: int = 1):    # type: ignore
         
         ### Technically this method shouldn't be called `train`,
         ### because this means it overrides not only `LanguageModel.train` (as desired)
@@ -509,74 +1599,41 @@ class EmbeddingLogLinearLanguageModel(LanguageModel, nn.Module):
         nn.init.zeros_(self.X)   # type: ignore
         nn.init.zeros_(self.Y)   # type: ignore
 
-        N = num_tokens(file)
-        log.info("Start optimizing on {N} training tokens...")
-
-        #####################
-        # TODO: Implement your SGD here by taking gradient steps on a sequence
-        # of training examples.  Here's how to use PyTorch to make it easy:
-        #
-        # To get the training examples, you can use the `read_trigrams` function
-        # we provided, which will iterate over all N trigrams in the training
-        # corpus.
-        #
-        # For each successive training example i, compute the stochastic
-        # objective F_i(θ).  This is called the "forward" computation. Don't
-        # forget to include the regularization term.
-        #
-        # To get the gradient of this objective (∇F_i(θ)), call the `backward`
-        # method on the number you computed at the previous step.  This invokes
-        # back-propagation to get the gradient of this number with respect to
-        # the parameters θ.  This should be easier than implementing the
-        # gradient method from the handout.
+        # Read the whole corpus once, as three parallel tensors of ids
+        # (integerizing its chunks with `jobs` processes).
+        with profiling.timer("train: read"):
+            tokens = list(map_chunks(read_chunk, corpus_chunks(corpus), self.vocab, jobs))
+            xs, ys, zs = (torch.from_numpy(ids) for ids in trigram_arrays(np.concatenate([np.zeros(0, dtype=np.int64)] + tokens)))
+        N = len(zs)
+        log.info(f"Start optimizing on {N} training tokens...")
+
+        # Each SGD step maximizes the objective F_i(θ) summed over a minibatch
+        # of trigrams i.  With batch_size 1, this is the classic one-trigram-
+        # at-a-time SGD.  Larger batches take fewer, better-informed steps,
+        # and compute each of them with a few big matrix operations.
         #
-        # Finally, update the parameters in the direction of the gradient, as
-        # shown in Algorithm 1 in the reading handout.  You can do this `+=`
-        # yourself, or you can call the `step` method of the `optimizer` object
-        # we created above.  See the reading handout for more details on this.
-        #
-        # For the EmbeddingLogLinearLanguageModel, you should run SGD
-        # optimization for 10 epochs and then stop.  You might want to print
-        # progress dots using the `show_progress` method defined above.  Even
-        # better, you could show a graphical progress bar using the tqdm module --
-        # simply iterate over
-        # instead of iterating over
-        #     read_trigrams(file)
-        #####################
-        
-        #torch.autograd.set_detect_anomaly(True)
-        #with trange(10) as pbar:
-            #for i in pbar:
-        for i in range(10):
-            total_loss = 0
-            loss = 0
-            
-            for trigram in tqdm.tqdm(read_trigrams(file, self.vocab), total=N):
-            #  for trigram in read_trigrams(file, self.vocab):
-                loss = torch.log(self.prob(trigram[0],trigram[1],trigram[2]))      
-                #loss += self.prob(trigram[0],trigram[1],trigram[2])
-                
-            
-                l2_reg = torch.tensor(0.)
-                for param in self.parameters():
-                    l2_reg += torch.norm(param)
-
-                loss = (loss - self.l2 * l2_reg)/N
-                (-loss).backward()
-                optimizer.step()
-                optimizer.zero_grad() 
-                #pdb.set_trace()
-                total_loss = total_loss + loss.item()
-
-        
-            
-            
-            # if math.isnan(self.X[0][0].item()) :
-            #      pdb.set_trace()
-            #pdb.set_trace()
-            #pbar.set_description(f"Epoch {i}: F = {loss.item()} ")
-            print(f"epoch {i+1}: F = {total_loss} ")
+        # Optionally, skip autograd and compute the same gradient in closed
+        # form, which is much faster when the embeddings are small.
+        gradient = LogLinearGradient(self.vocab_emb, self.X, self.Y, self.l2, self.batch_size) \
+            if self.closed_form else None
+        with profiling.timer("train: optimize"):
+            for i in range(self.epochs):
+                total_F = 0.0
+                order = torch.randperm(N) if self.shuffle else torch.arange(N)
+                for start in tqdm.tqdm(range(0, N, self.batch_size), total=math.ceil(N / self.batch_size)):
+                    batch = order[start:start + self.batch_size]
+                    if gradient is not None:
+                        total_F += gradient.step(xs[batch], ys[batch], zs[batch], N)   # sets the .grad fields
+                        optimizer.step()
+                        continue
+                    F = self.objective(xs[batch], ys[batch], zs[batch], N)
+                    (-F).backward()
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    total_F += F.item()
+                print(f"epoch {i+1}: F = {total_F} ")
        
+        self.clear_caches()  # they were computed from the old parameters
         log.info("done optimizing.")
 
         # So how does the `backward` method work?
@@ -600,218 +1657,37 @@ class EmbeddingLogLinearLanguageModel(LanguageModel, nn.Module):
         # get its gradient -- i.e., to find out how rapidly it would change if
         # each parameter were changed slightly.
 
+    def update(self, corpus: Corpus, jobs: int = 1, new_words: Iterable[Word] = (),
+               promote_threshold: Optional[int] = None) -> None:
+        """Log-linear models can't be updated with more data, by design.  Their
+        parameters aren't counts that the new data's could just be added to:
+        they were fit by SGD to the old data, so the only way to get the model
+        of the old data and the new data together is to retrain it on both."""
+        raise TypeError(f"{type(self).__name__} can't be updated with new data, since its parameters "
+                        f"aren't counts; retrain it on all the data instead")
 
-        
-
-        # So how does the `backward` method work?
-        #
-        # As Python sees it, your parameters and the values that you compute
-        # from them are not actually numbers.  They are `torch.Tensor` objects.
-        # A Tensor may represent a numeric scalar, vector, matrix, etc.
-        #
-        # Every Tensor knows how it was computed.  For example, if you write `a
-        # = b + exp(c)`, PyTorch not only computes `a` but also stores
-        # backpointers in `a` that remember how the numeric value of `a` depends
-        # on the numeric values of `b` and `c`.  In turn, `b` and `c` have their
-        # own backpointers that remember what they depend on, and so on, all the
-        # way back to the parameters.  This is just like the backpointers in
-        # parsing!
-        #
-        # Every Tensor has a `backward` method that computes the gradient of its
-        # numeric value with respect to the parameters, using "back-propagation"
-        # through this computation graph.  In particular, once you've computed
-        # the forward quantity F_i(θ) as a tensor, you can trace backwards to
-        # get its gradient -- i.e., to find out how rapidly it would change if
-        # each parameter were changed slightly.
+    def objective(self, xs: torch.Tensor, ys: torch.Tensor, zs: torch.Tensor, N: int) -> torch.Tensor:
+        """The sum of the per-trigram objectives F_i(θ) = (log p(z_i | x_i y_i) - l2 R(θ)) / N
+        over a minibatch of trigrams, as a single differentiable scalar.  Here
+        R(θ) = ||X|| + ||Y|| is the regularizer and N is the size of the corpus."""
+        log_likelihood = (self.trigram_scores(xs, ys, zs) - self.log_normalizers(xs, ys)).sum()
+        regularizer = torch.norm(self.X) + torch.norm(self.Y)
+        return (log_likelihood - len(zs) * self.l2 * regularizer) / N
 
 
 class ImprovedLogLinearLanguageModel(EmbeddingLogLinearLanguageModel):
-    # TODO: IMPLEMENT ME!
-    
     # This is where you get to come up with some features of your own, as
     # described in the reading handout.  This class inherits from
     # EmbeddingLogLinearLanguageModel and you can override anything, such as
     # `log_prob`.
-
-    # OTHER OPTIONAL IMPROVEMENTS: You could override the `train` method.
-    # Instead of using 10 epochs, try "improving the SGD training loop" as
-    # described in the reading handout.  Some possibilities:
     #
-    # * You can use the `draw_trigrams_forever` function that we
-    #   provided to shuffle the trigrams on each epoch.
-    #
-    # * You can choose to compute F_i using a mini-batch of trigrams
-    #   instead of a single trigram, and try to vectorize the computation
-    #   over the mini-batch.
-    #
-    # * Instead of running for exactly 10*N trigrams, you can implement
-    #   early stopping by giving the `train` method access to dev data.
-    #   This will run for as long as continued training is helpful,
-    #   so it might run for more or fewer than 10*N trigrams.
-    #
-    # * You could use a different optimization algorithm instead of SGD, such
-    #   as `torch.optim.Adam` (https://pytorch.org/docs/stable/optim.html).
-    #
-    def prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> float:
-        # This returns an ordinary float probability, using the
-        # .item() method that extracts a number out of a Tensor.
-        #pdb.set_trace()
-            batchz = torch.zeros((len(z),self.dim),dtype=torch.float32)
-            batchy = torch.zeros((len(z),self.dim),dtype=torch.float32)
-            batchx = torch.zeros((len(z),self.dim),dtype=torch.float32)
-            count = 0
-            for zi in z:
-                if (zi =="OOV" or zi not in self.lexicon.word_to_int.keys()):
-                    zi = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-                else:
-                    zi = self.lexicon.embeddings[self.lexicon.word_to_int[zi]] 
-                batchz[count,:] = zi
-                count+=1
-
-            count = 0
-            for yi in y:
-                if (yi=="OOV" or yi not in self.lexicon.word_to_int.keys()):
-                    yi = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-                else:
-                    yi = self.lexicon.embeddings[self.lexicon.word_to_int[yi]] 
-                batchy[count,:] = yi
-                count+=1
-            count = 0
-            for xi in x:
-                if (xi=="OOV" or xi not in self.lexicon.word_to_int.keys()):
-                    xi = self.lexicon.embeddings[self.lexicon.word_to_int["OOL"]]
-                else:
-                    xi = self.lexicon.embeddings[self.lexicon.word_to_int[xi]] 
-                batchx[count,:] = xi
-                count+=1
-            p = self.log_prob(batchx, batchy, batchz)
-        # assert isinstance(p, float)  # checks that we'll adhere to the return type annotation, which is inherited from superclass
-            return torch.exp(p)
-
-    def log_prob(self, x: Wordtype, y: Wordtype, z: Wordtype) -> torch.Tensor:
-        """Return log p(z | xy) according to this language model."""
-        # TODO: IMPLEMENT ME!
-        # Don't forget that you can create additional methods
-        # that you think are useful, if you'd like.
-        # It's cleaner than making this function massive.
-        #
-        # Be sure to use vectorization over the vocabulary to
-        # compute the normalization constant Z, or this method
-        # will be very slow.
-        #
-        # The operator `@` is a nice way to write matrix multiplication:
-        # you can write J @ K as shorthand for torch.mul(J, K).
-        # J @ K looks more like the usual math notation.
-        #pdb.set_trace()
-        x = x.double()
-        y = y.double()
-        z = x.double()
-        Xmat = torch.matmul(x,self.X.double())
-        Ymat =  torch.matmul(y,self.Y.double())
-        # Z_den = torch.sum(torch.exp(torch.matmul(Xmat,torch.transpose(self.vocab_emb,0,1).double())
-        #                      + torch.matmul(Ymat,torch.transpose(self.vocab_emb,0,1).double())))
-        #if self.Z_den == None:
-        Z_den = torch.logsumexp(torch.matmul(Xmat,torch.transpose(self.vocab_emb,0,1).double())
-                                + torch.matmul(Ymat,torch.transpose(self.vocab_emb,0,1).double()),1)
-        #else:
-        #    Z_den = self.Z_den
-        p_num = torch.logsumexp(torch.matmul(Xmat,torch.transpose(z,0,1)) + torch.matmul(Ymat,torch.transpose(z,0,1)),1)
-        p = torch.sum(torch.log(p_num) - Z_den)
-        #self.Z_den = Z_den.item()
-        
-        return p
-
-    def train(self, file: Path):    # type: ignore
-        
-        ### Technically this method shouldn't be called `train`,
-        ### because this means it overrides not only `LanguageModel.train` (as desired)
-        ### but also `nn.Module.train` (which has a different type). 
-        ### However, we won't be trying to use the latter method.
-        ### The `type: ignore` comment above tells the type checker to ignore this inconsistency.
-        
-        # Optimization hyperparameters.
-        gamma0 = 0.1  # initial learning rate
-
-        # This is why we needed the nn.Parameter above.
-        # The optimizer needs to know the list of parameters
-        # it should be trying to update.
-        optimizer = optim.SGD(self.parameters(), lr=gamma0)
-
-        # Initialize the parameter matrices to be full of zeros.
-        nn.init.zeros_(self.X)   # type: ignore
-        nn.init.zeros_(self.Y)   # type: ignore
-
-        N = num_tokens(file)
-        log.info("Start optimizing on {N} training tokens...")
-
-        #####################
-        # TODO: Implement your SGD here by taking gradient steps on a sequence
-        # of training examples.  Here's how to use PyTorch to make it easy:
-        #
-        # To get the training examples, you can use the `read_trigrams` function
-        # we provided, which will iterate over all N trigrams in the training
-        # corpus.
-        #
-        # For each successive training example i, compute the stochastic
-        # objective F_i(θ).  This is called the "forward" computation. Don't
-        # forget to include the regularization term.
-        #
-        # To get the gradient of this objective (∇F_i(θ)), call the `backward`
-        # method on the number you computed at the previous step.  This invokes
-        # back-propagation to get the gradient of this number with respect to
-        # the parameters θ.  This should be easier than implementing the
-        # gradient method from the handout.
-        #
-        # Finally, update the parameters in the direction of the gradient, as
-        # shown in Algorithm 1 in the reading handout.  You can do this `+=`
-        # yourself, or you can call the `step` method of the `optimizer` object
-        # we created above.  See the reading handout for more details on this.
-        #
-        # For the EmbeddingLogLinearLanguageModel, you should run SGD
-        # optimization for 10 epochs and then stop.  You might want to print
-        # progress dots using the `show_progress` method defined above.  Even
-        # better, you could show a graphical progress bar using the tqdm module --
-        # simply iterate over
-        # instead of iterating over
-        #     read_trigrams(file)
-        #####################
-        
-        #torch.autograd.set_detect_anomaly(True)
-        #with trange(10) as pbar:
-            #for i in pbar:
-        batch_size=64
-        batchx = []
-        batchy = []
-        batchz = []
-        for i in range(10):
-            total_loss = 0
-            loss = 0
-            
-            for trigram in tqdm.tqdm(read_trigrams(file, self.vocab), total=N):
-            #  for trigram in read_trigrams(file, self.vocab):
-                count=0
-                while count < batch_size:
-                    batchx.append(trigram[0])
-                    batchy.append(trigram[1])
-                    batchz.append(trigram[2])
-                    count+=1
-                    #pdb.set_trace()
-                loss = torch.log(self.prob(batchx,batchy,batchz))
-                
-                l2_reg = torch.tensor(0.)
-                for param in self.parameters():
-                    l2_reg += torch.norm(param)
-                loss =  (loss - self.l2 * l2_reg)/N
-                total_loss = total_loss + loss.item()
-        
-            
-            (-loss).backward(retain_graph=True)
-            optimizer.step()
-            optimizer.zero_grad() 
-            # if math.isnan(self.X[0][0].item()) :
-            #      pdb.set_trace()
-            #pdb.set_trace()
-            #pbar.set_description(f"Epoch {i}: F = {loss.item()} ")
-            print(f"epoch {i+1}: F = {total_loss} ")
-       
-        log.info("done optimizing.")
+    # So far, the improvement is to the SGD training loop: we shuffle the
+    # trigrams on each epoch and compute F_i on a minibatch of trigrams at
+    # a time, which is vectorized over the minibatch (see `objective`).
+
+    def __init__(self, vocab: Vocab, lexicon_file: Path, l2: float,
+                 precompute: bool = False, cache_size: int = 2 ** 16,
+                 epochs: int = 10, batch_size: int = 64, shuffle: bool = True,
+                 closed_form: bool = False) -> None:
+        super().__init__(vocab, lexicon_file, l2, precompute, cache_size,
+                         epochs=epochs, batch_size=batch_size, shuffle=shuffle, closed_form=closed_form)
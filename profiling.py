@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Opt-in instrumentation, for finding out where a slow job spends its time.
+
+It is off unless a script calls `enable` (e.g., for its --profile flag).
+While it's off, the hooks cost next to nothing: `timer` hands back a
+do-nothing context manager, and the language models' own methods are
+left alone.  Only `instrument`, which does nothing while profiling is
+off, wraps a model's `prob` and `log_prob_ngrams` with versions that count
+their calls (and, for backoff models, how far each n-gram backed off).
+
+What it records:
+  * counts of events, such as calls to `prob` and n-grams scored
+  * seconds spent in each timed phase, such as loading, tokenizing and scoring
+  * the hit rates of the models' caches (see lru.py)
+  * optionally, a cProfile of everything, saved in pstats format
+
+Only work done in this process is recorded, not work done by the
+worker processes of --jobs.
+"""
+import cProfile
+import contextlib
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, TextIO
+
+import numpy as np
+
+
+class Profile:
+    """What has been recorded since profiling was enabled."""
+
+    def __init__(self, stats_file: Optional[Path] = None) -> None:
+        self.counts: Counter[str] = Counter()
+        self.seconds: Counter[str] = Counter()
+        self.models: List[Any] = []   # the instrumented language models
+        self.stats_file = stats_file
+        self.profiler = cProfile.Profile() if stats_file is not None else None
+
+
+_profile: Optional[Profile] = None   # None while profiling is off
+_no_timer = contextlib.nullcontext()
+
+
+def enable(stats_file: Optional[Path] = None) -> None:
+    """Start recording.  If stats_file is given, also run cProfile, and save
+    its statistics there when `report` is called."""
+    global _profile
+    _profile = Profile(stats_file)
+    if _profile.profiler is not None:
+        _profile.profiler.enable()
+
+
+def enabled() -> bool:
+    return _profile is not None
+
+
+def count(event: str, n: int = 1) -> None:
+    """Record n occurrences of an event."""
+    if _profile is not None:
+        _profile.counts[event] += n
+
+
+def timer(phase: str) -> ContextManager:
+    """A context manager that adds the time spent in its body to the total for phase."""
+    return _no_timer if _profile is None else _timed(_profile, phase)
+
+
+@contextlib.contextmanager
+def _timed(profile: Profile, phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.seconds[phase] += time.perf_counter() - start
+
+
+def instrument(lm: Any) -> None:
+    """Count the calls that go through a language model's hot paths, by
+    shadowing its methods with counting versions on this instance only."""
+    if _profile is None:
+        return
+    profile = _profile
+    profile.models.append(lm)
+    prob, log_prob_ngrams = lm.prob, lm.log_prob_ngrams
+    backoff_levels = getattr(lm, "backoff_levels", None)
+    names = ["OOV", "unigram", "bigram", "trigram"] + [f"{k}-gram" for k in range(4, lm.order + 1)]
+
+    def counting_prob(x, y, z):
+        p = prob(x, y, z)   # (first, in case the model can't score trigrams)
+        profile.counts["prob calls"] += 1
+        if backoff_levels is not None:
+            level = backoff_levels(np.array([[x, y, z]])).item(0)
+            profile.counts[f"backoff: longest seen n-gram is {names[level]}"] += 1
+        return p
+
+    def counting_log_prob_ngrams(ngrams):
+        log_probs = log_prob_ngrams(ngrams)
+        profile.counts["log_prob_ngrams calls"] += 1
+        profile.counts["n-grams scored"] += len(ngrams)
+        if backoff_levels is not None:
+            for level, n in enumerate(np.bincount(backoff_levels(ngrams), minlength=len(names)).tolist()):
+                profile.counts[f"backoff: longest seen n-gram is {names[level]}"] += n
+        return log_probs
+
+    lm.prob = counting_prob
+    lm.log_prob_ngrams = counting_log_prob_ngrams
+
+
+def report(file: TextIO = sys.stderr) -> None:
+    """Print a summary of what was recorded (and save the cProfile statistics, if any)."""
+    if _profile is None:
+        return
+    if _profile.profiler is not None:
+        _profile.profiler.disable()
+        _profile.profiler.dump_stats(str(_profile.stats_file))
+    print("Profile:", file=file)
+    for phase, seconds in sorted(_profile.seconds.items()):
+        print(f"  {phase}: {seconds:.3f} s", file=file)
+    for event, n in sorted(_profile.counts.items()):
+        print(f"  {event}: {n}", file=file)
+    for i, lm in enumerate(_profile.models):
+        for name, cache in sorted(_cache_stats(lm).items()):
+            print(f"  model {i} ({type(lm).__name__}) cache {name}: {cache}", file=file)
+    if _profile.stats_file is not None:
+        print(f"  cProfile statistics saved to {_profile.stats_file} (read them with python -m pstats)", file=file)
+
+
+def _cache_stats(lm: Any) -> Dict[str, Dict[str, Any]]:
+    """The statistics of each cache that the model has as an attribute."""
+    return {name: value.stats() for name, value in vars(lm).items()
+            if callable(getattr(value, "stats", None)) and hasattr(value, "maxsize")}
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Samples random sentences from a trigram language model.
+
+Each next word is drawn from the model's distribution p(z | xy) over the
+whole vocabulary, which `LanguageModel.next_word_distribution` returns as
+a single vector.  To draw from it in constant time, we turn it into an
+alias table (Walker 1977; Vose 1991), and since the same contexts xy come
+up again and again, we keep the tables of recently used contexts in an
+LRU cache.  Many sentences are generated at once: at each step, all the
+unfinished sentences that share a context draw their next words together.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from lru import LRUCache
+from probs import BOS_ID, EOS_ID, LanguageModel
+
+
+class AliasTable:
+    """
+    A table for drawing samples from a fixed distribution p over 0 ... n-1
+    in O(1) time each.  To draw, pick a column i uniformly at random, then
+    return i with probability prob[i], and alias[i] otherwise.
+
+    >>> table = AliasTable(np.array([0.5, 0.2, 0.3, 0.0]))
+    >>> np.allclose(table.distribution(), [0.5, 0.2, 0.3, 0.0])
+    True
+    >>> counts = np.bincount(table.sample(100000, np.random.default_rng(0)), minlength=4)
+    >>> bool(np.abs(counts / 100000 - [0.5, 0.2, 0.3, 0.0]).max() < 0.01)
+    True
+    """
+
+    def __init__(self, p: np.ndarray) -> None:
+        n = len(p)
+        q = p * (n / p.sum())   # scaled so that the average column has height 1
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        # Each short column i (q[i] < 1) must be topped up by a tall one, out
+        # of the tall columns' excess height.  Lay the short columns' deficits
+        # end to end on a line, and likewise the tall columns' excesses (both
+        # add up to the same total).  Short column i takes its whole deficit
+        # from the tall column j whose excess covers the point where i's
+        # deficit starts.  That may take more than j's excess, by an
+        # overshoot o[j], which leaves j itself short by o[j], and it is
+        # topped up from the next tall column, j+1.  (This gives a table like
+        # the one from Vose's algorithm, but without a Python loop over columns.)
+        short = np.flatnonzero(q < 1)
+        tall = np.flatnonzero(q >= 1)
+        if len(short) == 0 or len(tall) == 0:
+            return   # all the columns have height 1 (up to rounding)
+        deficit = 1 - q[short]
+        deficit_start = np.cumsum(deficit) - deficit
+        excess_end = np.cumsum(q[tall] - 1)
+        j = np.minimum(excess_end.searchsorted(deficit_start, side="right"), len(tall) - 1)
+        self.prob[short] = q[short]
+        self.alias[short] = tall[j]
+
+        # The deficits assigned to tall columns up to and including j end at
+        # the start of the first deficit that starts at or after excess_end[j].
+        k = deficit_start.searchsorted(excess_end)
+        assigned_end = np.where(k < len(short), deficit_start[np.minimum(k, len(short) - 1)], deficit.sum())
+        overshoot = np.clip(assigned_end - excess_end, 0, 1)
+        overshoot[-1] = 0   # the last tall column has nothing left over (up to rounding)
+        self.prob[tall] = 1 - overshoot
+        self.alias[tall[:-1]] = tall[1:]
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def sample(self, k: int, rng: np.random.Generator) -> np.ndarray:
+        """Draw k independent samples."""
+        columns = rng.integers(len(self), size=k)
+        return np.where(rng.random(k) < self.prob[columns], columns, self.alias[columns])
+
+    def distribution(self) -> np.ndarray:
+        """The distribution that this table samples from (for testing)."""
+        n = len(self)
+        p = self.prob.copy()
+        np.add.at(p, self.alias, 1 - self.prob)
+        return p / n
+
+
+class Sampler:
+    """Generates sentences from a language model `lm`, caching the alias
+    tables of recently used contexts in at most about `cache_bytes` of memory."""
+
+    def __init__(self, lm: LanguageModel, cache_bytes: int = 2 ** 28, seed: Optional[int] = None) -> None:
+        self.lm = lm
+        table_bytes = 16 * len(lm.vocab)   # a float64 and an int64 per word type
+        self.tables: LRUCache[AliasTable] = LRUCache(max(1, cache_bytes // table_bytes))
+        # Building an alias table only pays off if we draw from it many times.
+        # So the first time we see a context, we just draw from its distribution
+        # directly, and remember the context so that we build its table next time.
+        self.seen: LRUCache[bool] = LRUCache(2 ** 20)
+        self.rng = np.random.default_rng(seed)
+
+    def draw(self, contexts: np.ndarray, counts: np.ndarray) -> List[np.ndarray]:
+        """Draw counts[i] next words after each of an array of contexts, each
+        encoded as x*|V| + y.  The distributions p(z | xy) of the contexts
+        that aren't cached are computed together, in batches."""
+        V = len(self.lm.vocab)
+        tables = [self.tables.get(context) for context in contexts.tolist()]
+        draws: List[np.ndarray] = [table.sample(count, self.rng) if table is not None else None   # type: ignore
+                                   for table, count in zip(tables, counts.tolist())]
+        missing = [i for i, table in enumerate(tables) if table is None]
+        batch_size = max(1, 2 ** 22 // V)   # bounds the size of the matrix of distributions
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            xs, ys = np.divmod(contexts[batch], V)
+            for i, p in zip(batch, self.lm.next_word_distributions(xs, ys)):
+                context, count = contexts.item(i), counts.item(i)
+                if self.seen.get(context) is None and count < 32:
+                    self.seen[context] = True
+                    cdf = np.cumsum(p)
+                    draws[i] = np.minimum(cdf.searchsorted(self.rng.random(count) * cdf[-1], side="right"), V - 1)
+                else:
+                    table = self.tables[context] = AliasTable(p)
+                    draws[i] = table.sample(count, self.rng)
+        return draws
+
+    def sample_ids(self, n: int, max_length: int) -> List[Tuple[List[int], bool]]:
+        """Generate n sentences of at most max_length words each.  Returns
+        each sentence as a list of word ids (without EOS), and whether it
+        was cut off at max_length before it ended."""
+        V = len(self.lm.vocab)
+        words = np.full((n, max_length), EOS_ID, dtype=np.int64)
+        lengths = np.full(n, max_length)
+        xs = np.full(n, BOS_ID, dtype=np.int64)
+        ys = np.full(n, BOS_ID, dtype=np.int64)
+        active = np.arange(n)   # the sentences that haven't ended yet
+        for t in range(max_length):
+            if len(active) == 0:
+                break
+            # Draw the next words of all the sentences that share a context together.
+            contexts, inverse, counts = np.unique(xs[active] * V + ys[active], return_inverse=True, return_counts=True)
+            by_context = np.argsort(inverse, kind="stable")
+            zs = np.empty(len(active), dtype=np.int64)
+            zs[by_context] = np.concatenate(self.draw(contexts, counts))
+            words[active, t] = zs
+            ended = zs == EOS_ID
+            lengths[active[ended]] = t
+            xs[active], ys[active] = ys[active], zs
+            active = active[~ended]
+        truncated = np.zeros(n, dtype=bool)
+        truncated[active] = True   # they never got to EOS
+        return [(words[i, :lengths[i]].tolist(), bool(truncated[i])) for i in range(n)]
+
+    def sample(self, n: int, max_length: int) -> List[str]:
+        """Like `sample_ids`, but returns each sentence as a string, ending
+        in "..." if it was cut off."""
+        vocab = self.lm.vocab
+        return [" ".join([vocab[w] for w in ids] + (["..."] if truncated else []))
+                for ids, truncated in self.sample_ids(n, max_length)]
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Scores test files under one or more language models, for fileprob.py,
+textcat.py and langid.py.
+
+Each file is read only once, however many models there are: its tokens
+are integerized once per distinct vocabulary and then scored by each
+model with `log_prob_ngrams`.  (The n-grams are as long as the highest
+order of the models that share the vocabulary, or trigrams if that's
+higher; each model uses as many of their last words as it needs.)
+
+With jobs > 1, the files are scored by a pool of worker processes.  The
+workers get the already loaded models (for free, where processes are
+forked, since they then share the parent's memory; otherwise by
+pickling), and the files are handed out in chunks of about equal total
+size.  Either way, the results come back in the order of the input files.
+"""
+import multiprocessing
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import profiling
+from probs import OOV_ID, LanguageModel, Vocab, ngram_arrays, read_ngram_arrays, read_tokens
+
+# The scorer of a worker process (see `_init_worker`).
+_worker_scorer: Optional["Scorer"] = None
+
+
+class Scorer:
+    """Computes the log-probability of a file under each of several language
+    models, reading the file just once.  Models that share a vocabulary also
+    share the integerized n-grams of the file."""
+
+    def __init__(self, lms: Sequence[LanguageModel]) -> None:
+        self.lms = lms
+        self.vocabs: List[Vocab] = []     # the distinct vocabularies
+        self.vocab_numbers: List[int] = []   # the position in self.vocabs of each model's vocabulary
+        for lm in lms:
+            for i, vocab in enumerate(self.vocabs):
+                if vocab is lm.vocab or vocab == lm.vocab:
+                    break
+            else:
+                i = len(self.vocabs)
+                self.vocabs.append(lm.vocab)
+            self.vocab_numbers.append(i)
+        # The length of the n-grams to read for each vocabulary.
+        self.widths = [3] * len(self.vocabs)
+        # Whether to sort the n-grams of each vocabulary: only if some model
+        # that shares it looks them up in its counts (see `__call__`).
+        self.sort = [False] * len(self.vocabs)
+        for lm, i in zip(lms, self.vocab_numbers):
+            self.widths[i] = max(self.widths[i], lm.order)
+            self.sort[i] = self.sort[i] or lm.SORTED_LOOKUPS
+
+    def __call__(self, file: Path) -> List[float]:
+        with profiling.timer("tokenize"):
+            if len(self.vocabs) == 1:
+                ngrams = [read_ngram_arrays(file, self.vocabs[0], self.widths[0])]
+            else:
+                words = list(read_tokens(file))
+                ngrams = [ngram_arrays(_integerize(words, vocab), width) for vocab, width in zip(self.vocabs, self.widths)]
+            # The count-based models look up each n-gram by binary search,
+            # which is much faster on sorted queries.  The order of the
+            # n-grams doesn't matter, since we only want the total.  (Other
+            # models would gain nothing from the sort.)
+            ngrams = [_sorted_ngrams(rows, len(vocab)) if sort else rows
+                      for rows, vocab, sort in zip(ngrams, self.vocabs, self.sort)]
+        log_probs = []
+        with profiling.timer("score"):
+            for lm, i in zip(self.lms, self.vocab_numbers):
+                log_probs.append(float(lm.log_prob_ngrams(ngrams[i]).sum()))   # sum of log p(w | h)
+        return log_probs
+
+
+def file_log_prob(file: Path, lm: LanguageModel) -> float:
+    """The file contains one sentence per line. Return the total
+    log-probability of all these sentences, under the given language model.
+    (This is a natural log, as for all our internal computations.)
+    """
+    return Scorer([lm])(file)[0]
+
+
+def score_files(files: Sequence[Path], lms: Sequence[LanguageModel],
+                jobs: int = 1) -> Iterator[Tuple[Path, List[float]]]:
+    """Yield each file with its log-probabilities under each of the models,
+    in the order of `files`, using `jobs` processes."""
+    scorer = Scorer(lms)
+    if jobs <= 1 or len(files) <= 1:
+        for file in files:
+            yield file, scorer(file)
+        return
+
+    # Several chunks per worker, so that the workers finish at about the same time.
+    chunks = _balanced_chunks(files, 4 * jobs)
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    context = multiprocessing.get_context(start_method)
+    with context.Pool(jobs, initializer=_init_worker, initargs=(scorer,)) as pool:
+        for chunk, results in zip(chunks, pool.imap(_score_chunk, chunks)):
+            yield from zip(chunk, results)
+
+
+def _init_worker(scorer: Scorer) -> None:
+    global _worker_scorer
+    _worker_scorer = scorer
+
+
+def _score_chunk(files: Sequence[Path]) -> List[List[float]]:
+    assert _worker_scorer is not None
+    return [_worker_scorer(file) for file in files]
+
+
+def _balanced_chunks(files: Sequence[Path], num_chunks: int) -> List[List[Path]]:
+    """Split files into about num_chunks runs of consecutive files, of about
+    equal total size in bytes.  (Consecutive, so that the results of the
+    chunks can simply be concatenated to keep the input order.)"""
+    sizes = [max(os.path.getsize(file), 1) for file in files]
+    target = sum(sizes) / num_chunks
+    chunks: List[List[Path]] = [[]]
+    chunk_size = 0
+    for file, size in zip(files, sizes):
+        if chunks[-1] and chunk_size + size / 2 > target:   # this file fits better in a new chunk
+            chunks.append([])
+            chunk_size = 0
+        chunks[-1].append(file)
+        chunk_size += size
+    return chunks
+
+
+def _sorted_ngrams(ngrams: np.ndarray, radix: int) -> np.ndarray:
+    """The rows of a 2-D array of n-grams in lexicographic order (that is,
+    in the order of the keys of `NgramCounts`, which has the same radix)."""
+    width = ngrams.shape[1]
+    if radix ** width < 2 ** 63:   # they fit in packed keys, which are faster to sort
+        order = np.argsort(ngrams @ radix ** np.arange(width - 1, -1, -1, dtype=np.int64))
+    else:
+        order = np.lexsort(ngrams.T[::-1])
+    return ngrams[order]
+
+
+def _integerize(words: Sequence[str], vocab: Vocab) -> np.ndarray:
+    """The ids of words, as `read_tokens` would give them with this vocab."""
+    index = vocab.index
+    return np.fromiter((OOV_ID if i is None else i for i in map(index, words)),
+                       dtype=np.int64, count=len(words))
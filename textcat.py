@@ -8,9 +8,10 @@ import logging
 import math
 from pathlib import Path
 import pdb
-import torch
 
-from probs import LanguageModel, num_tokens, read_trigrams
+import profiling
+from probs import LanguageModel, num_tokens
+from scoring import score_files
 
 log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
 
@@ -34,6 +35,24 @@ def parse_args() -> argparse.Namespace:
         nargs="*"
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to score the test files with (default 1)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="At the end, print where the time went and how often the model's hot paths ran",
+    )
+    parser.add_argument(
+        "--profile_stats",
+        type=Path,
+        default=None,
+        help="With --profile, also save cProfile statistics to this file (for python -m pstats)",
+    )
+
     verbosity = parser.add_mutually_exclusive_group()
     verbosity.add_argument(
         "-v",
@@ -49,30 +68,17 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def file_log_prob(file: Path, lm: LanguageModel) -> float:
-    """The file contains one sentence per line. Return the total
-    log-probability of all these sentences, under the given language model.
-    (This is a natural log, as for all our internal computations.)
-    """
-    log_prob = 0.0
-    for (x, y, z) in read_trigrams(file, lm.vocab):
-        prob = lm.prob(x, y, z)  # p(z | xy)
-        #pdb.set_trace()
-        if torch.is_tensor(prob):
-            prob = prob.item()
-            log_prob += prob
-        else:
-            log_prob += math.log(prob)
-    return log_prob
-
-
 def main():
     args = parse_args()
     logging.basicConfig(level=args.verbose)
+    if args.profile:
+        profiling.enable(args.profile_stats)
+        if args.jobs > 1:
+            log.warning("--profile only records the main process, not the --jobs workers")
 
     log.info("Testing...")
-    lm1 = LanguageModel.load(args.model[0])
-    lm2 = LanguageModel.load(args.model[1])
+    lm1 = LanguageModel.load(args.model[0], mmap=True)
+    lm2 = LanguageModel.load(args.model[1], mmap=True)
     assert lm1.vocab == lm2.vocab, "Make sure both models have the same vocabulary"
     prior1 = args.prior
     prior2 = 1 - prior1
@@ -84,9 +90,8 @@ def main():
     log.info("Per-file log-probabilities:")
     count_spam = 0
     count_gen = 0
-    for file in args.test_files:
-        log_prob1: float = file_log_prob(file, lm1)
-        log_prob2: float = file_log_prob(file, lm2)
+    # Score each file under both models at once.
+    for file, (log_prob1, log_prob2) in score_files(args.test_files, [lm1, lm2], args.jobs):
         if log_prob1+math.log(prior1) > log_prob2+math.log(prior2):
             print(f"{args.model[0]}\t{file}")
             count_gen+=1
@@ -97,6 +102,7 @@ def main():
     per_gen = round(count_gen/(count_spam+count_gen),2)*100
     print(f"{count_gen} files were more probably {args.model[0]} ({per_gen}%)")
     print(f"{count_spam} files were more probably {args.model[1]} ({per_spam}%)")
+    profiling.report()
 
 
 if __name__ == "__main__":
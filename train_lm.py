@@ -2,6 +2,8 @@
 """
 Trains a smoothed trigram model over a given vocabulary.
 Depending on the smoother, you need to supply hyperparameters and additional files.
+The add_lambda_backoff and kneser_ney smoothers can also train n-gram models
+of other orders (--order), and prune rare n-grams (--min_count).
 """
 import argparse
 import logging
@@ -9,23 +11,39 @@ from pathlib import Path
 import sys
 import pdb
 
-from probs import read_vocab, UniformLanguageModel, AddLambdaLanguageModel, \
-    BackoffAddLambdaLanguageModel, EmbeddingLogLinearLanguageModel, ImprovedLogLinearLanguageModel
+import torch
+
+import profiling
+from probs import read_vocab, LanguageModel, UniformLanguageModel, AddLambdaLanguageModel, \
+    BackoffAddLambdaLanguageModel, KneserNeyLanguageModel, EmbeddingLogLinearLanguageModel, \
+    ImprovedLogLinearLanguageModel
 
 log = logging.getLogger(Path(__file__).stem)  # Basically the only okay global variable.
 
 UNIFORM   = "uniform"
 ADDLAMBDA = "add_lambda"
 BACKOFF   = "add_lambda_backoff"
+KNESERNEY = "kneser_ney"
 LOGLINEAR = "log_linear"
 IMPROVED  = "log_linear_improved"
-SMOOTHERS = [UNIFORM, ADDLAMBDA, BACKOFF, LOGLINEAR, IMPROVED]
+SMOOTHERS = [UNIFORM, ADDLAMBDA, BACKOFF, KNESERNEY, LOGLINEAR, IMPROVED]
+NGRAM_SMOOTHERS = [BACKOFF, KNESERNEY]   # the ones that support --order and --min_count
+CLASSES = {UNIFORM: UniformLanguageModel, ADDLAMBDA: AddLambdaLanguageModel, BACKOFF: BackoffAddLambdaLanguageModel,
+           KNESERNEY: KneserNeyLanguageModel, LOGLINEAR: EmbeddingLogLinearLanguageModel,
+           IMPROVED: ImprovedLogLinearLanguageModel}
 
 
 def get_model_filename(args: argparse.Namespace) -> Path:
-    prefix = f"corpus={args.train_file.name}~vocab={args.vocab_file.name}~smoother={args.smoother}"
+    corpus = args.train_files[0].name + (f"+{len(args.train_files) - 1}" if len(args.train_files) > 1 else "")
+    prefix = f"corpus={corpus}~vocab={args.vocab_file.name}~smoother={args.smoother}"
+    if args.order != 3:
+        prefix += f"~order={args.order}"
+    if args.min_count != 1:
+        prefix += f"~min_count={args.min_count}"
     if args.smoother in [ADDLAMBDA, BACKOFF]:
         return Path(f"{prefix}~lambda={args.lambda_}.model")
+    elif args.smoother == KNESERNEY:   # (no hyperparameters besides the ones above)
+        return Path(f"{prefix}.model")
     elif args.smoother in [LOGLINEAR, IMPROVED]:
         return Path(f"{prefix}~lexicon={args.lexicon.name}~l2={args.l2_regularization}.model")
     else:   
@@ -47,9 +65,17 @@ def parse_args() -> argparse.Namespace:
         choices=SMOOTHERS
     )
     parser.add_argument(
-        "train_file",
+        "train_files",
         type=Path,
-        help="Training corpus (as a single file)"
+        nargs="+",
+        help="Training corpus: files, directories of files, or glob patterns (quoted, to keep the shell "
+             "from expanding them).  Files ending in .gz, .bz2, .xz or .zst are decompressed as they're read."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to read and count the training corpus with (default 1)",
     )
     parser.add_argument(
         "--output",
@@ -58,6 +84,24 @@ def parse_args() -> argparse.Namespace:
         help="Where to save the model (if not specified, will construct a filename with `get_model_filename`)"
     )
 
+    # for updating a trained model with more data
+    parser.add_argument(
+        "--resume_from",
+        "--resume-from",
+        type=Path,
+        default=None,
+        help="Instead of training from scratch, add the counts of the training corpus to this trained model "
+             "(count-based smoothers only, and not models pruned with --min_count).  Word types in vocab_file "
+             "that the model lacks are added to its vocab.",
+    )
+    parser.add_argument(
+        "--promote_threshold",
+        type=int,
+        default=None,
+        help="With --resume_from, also add to the vocab the OOV words that occur at least this many times "
+             "in the new training corpus",
+    )
+
     # for add lambda smoothers
     parser.add_argument(
         "--lambda",
@@ -67,6 +111,21 @@ def parse_args() -> argparse.Namespace:
         help="Strength of smoothing for add_lambda and add_lambda_backoff smoothers (default 0)",
     )
 
+    # for n-gram smoothers of other orders
+    parser.add_argument(
+        "--order",
+        type=int,
+        default=3,
+        help=f"Length of the n-grams to model, for the {' and '.join(NGRAM_SMOOTHERS)} smoothers (default 3)",
+    )
+    parser.add_argument(
+        "--min_count",
+        type=int,
+        default=1,
+        help=f"Prune the n-grams of order 3 and up that occur fewer than this many times, "
+             f"for the {' and '.join(NGRAM_SMOOTHERS)} smoothers (default 1, no pruning)",
+    )
+
     # # for log linear smoothers
     parser.add_argument(
         "--lexicon",
@@ -80,6 +139,47 @@ def parse_args() -> argparse.Namespace:
         default=0.0,
         help="Strength of L2 regularization in log-linear models (default 0)",
     )
+    parser.add_argument(
+        "--precompute",
+        action="store_true",
+        help="Precompute |V| x |V| tables of trigram scores for log-linear models (faster scoring, more memory)",
+    )
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        default=None,
+        help="Number of epochs of SGD for log-linear models (default 10)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=None,
+        help="Number of trigrams per SGD step for log-linear models "
+             f"(default 1 for {LOGLINEAR}, 64 for {IMPROVED})",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of CPU threads for PyTorch to use (default: PyTorch's own choice)",
+    )
+    parser.add_argument(
+        "--closed_form",
+        action="store_true",
+        default=None,
+        help="Compute log-linear gradients in closed form instead of by backpropagation (faster for small lexicons)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="At the end, print where the time went and how often the model's hot paths ran",
+    )
+    parser.add_argument(
+        "--profile_stats",
+        type=Path,
+        default=None,
+        help="With --profile, also save cProfile statistics to this file (for python -m pstats)",
+    )
 
     # for verbosity of output
     verbosity = parser.add_mutually_exclusive_group()
@@ -106,14 +206,26 @@ def check_args(args: argparse.Namespace):
     if args.smoother == LOGLINEAR:
         if args.lexicon is None:
             raise ValueError(f"--lexicon is required for {LOGLINEAR} smoother")
-    if args.smoother == ADDLAMBDA:
+    if args.resume_from is not None and args.smoother in [LOGLINEAR, IMPROVED]:
+        # (Checked before any data is read: their update would fail anyway.)
+        raise ValueError(f"--resume_from is only for count-based smoothers; "
+                         f"retrain the {args.smoother} model on all the data instead")
+    if args.smoother == ADDLAMBDA and args.resume_from is None:   # (a resumed model keeps its own lambda)
         if args.lambda_ == 0.0:
             log.warning("You're training an add-0 (unsmoothed) model")
+    if (args.order != 3 or args.min_count != 1) and args.smoother not in NGRAM_SMOOTHERS:
+        raise ValueError(f"--order and --min_count are only for the {' and '.join(NGRAM_SMOOTHERS)} smoothers")
+    if args.order < 1 or args.min_count < 1:
+        raise ValueError("--order and --min_count must be at least 1")
 
 def main():
     args = parse_args()
     logging.basicConfig(level=args.verbose)
     check_args(args)
+    if args.profile:
+        profiling.enable(args.profile_stats)
+        if args.jobs > 1:
+            log.warning("--profile only records the main process, not the --jobs workers")
 
     if args.output is None:
         model_path = get_model_filename(args)
@@ -124,29 +236,50 @@ def main():
         raise ValueError(f"Expected args.smoother to be one of {SMOOTHERS}, but got {args.smoother} instead")
     # Now construct a language model, giving the appropriate arguments to the constructor.
 
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    # Only override the log-linear models' own defaults for the options that were given.
+    training_options = {name: getattr(args, name) for name in ["epochs", "batch_size", "closed_form"]
+                        if getattr(args, name) is not None}
+
     vocab = read_vocab(args.vocab_file)
+    if args.resume_from is not None:
+        lm = LanguageModel.load(args.resume_from)
+        if type(lm) is not CLASSES[args.smoother]:
+            raise ValueError(f"{args.resume_from} is a {type(lm).__name__}, not a {args.smoother} model")
+        log.info("Updating...")
+        lm.update(args.train_files, jobs=args.jobs, new_words=vocab, promote_threshold=args.promote_threshold)
+        lm.save(destination=model_path)
+        profiling.report()
+        return
+
     if args.smoother == UNIFORM:
         lm = UniformLanguageModel(vocab)
     elif args.smoother == ADDLAMBDA:
         lm = AddLambdaLanguageModel(vocab, args.lambda_)
     elif args.smoother == BACKOFF:
-        lm = BackoffAddLambdaLanguageModel(vocab, args.lambda_)
+        lm = BackoffAddLambdaLanguageModel(vocab, args.lambda_, order=args.order, min_count=args.min_count)
+    elif args.smoother == KNESERNEY:
+        lm = KneserNeyLanguageModel(vocab, order=args.order, min_count=args.min_count)
     elif args.smoother == LOGLINEAR:
         if args.lexicon is None:
             log.error("{args.smoother} requires a lexicon")   # would be better to check this in argparse
             sys.exit(1)
-        lm = EmbeddingLogLinearLanguageModel(vocab, args.lexicon, args.l2_regularization)
+        lm = EmbeddingLogLinearLanguageModel(vocab, args.lexicon, args.l2_regularization, args.precompute,
+                                             **training_options)
     elif args.smoother == IMPROVED:
         if args.lexicon is None:
             log.error("{args.smoother} requires a lexicon")   # would be better to check this in argparse
             sys.exit(1)
-        lm = ImprovedLogLinearLanguageModel(vocab, args.lexicon, args.l2_regularization)
+        lm = ImprovedLogLinearLanguageModel(vocab, args.lexicon, args.l2_regularization, args.precompute,
+                                            **training_options)
     else:
         raise ValueError(f"Don't recognize smoother name {args.smoother}")
 
     log.info("Training...")
-    lm.train(args.train_file)
+    lm.train(args.train_files, jobs=args.jobs)
     lm.save(destination=model_path)
+    profiling.report()
 
 
 if __name__ == "__main__":